@@ -18,7 +18,13 @@ if __name__ == '__main__':
                         default="gpt-3.5-turbo", help="base LLM model.")
     parser.add_argument("--opeani_api_keys", type=int,
                         default="", help="if the LLM_type is gpt-3.5-turbo or gpt-4, you need add your own openai api keys.")
+    parser.add_argument("--llm_cache", type=str,
+                        default=None, help="path of a SQLite file caching LLM responses across runs (disabled by default).")
+    parser.add_argument("--llm_cache_max_mb", type=int,
+                        default=1024, help="size budget of the LLM response cache, least recently used entries are evicted.")
     args = parser.parse_args()
+    if args.llm_cache:
+        enable_llm_cache(args.llm_cache, args.llm_cache_max_mb << 20)
 
 with open("cot_{}.jsonl".format(args.dataset), 'a+', encoding="UTF-8") as out:
     datas, question_string = prepare_dataset(args.dataset)
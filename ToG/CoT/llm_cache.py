@@ -0,0 +1,97 @@
+import atexit
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+_DEFAULT_CACHE = None
+
+
+class LLMCache:
+    """
+    On-disk cache of LLM responses keyed by (model, prompt, temperature, max_tokens), stored in SQLite.
+    When the stored responses exceed max_bytes, the least recently used entries are evicted.
+    Safe to share between threads.
+    """
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt, temperature, max_tokens):
+        payload = json.dumps([model, prompt, float(temperature), int(max_tokens)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, model, prompt, temperature, max_tokens):
+        key = self.make_key(model, prompt, temperature, max_tokens)
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, model, prompt, temperature, max_tokens, response):
+        key = self.make_key(model, prompt, temperature, max_tokens)
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache is back under 90% of its budget.
+        target = int(self.max_bytes * 0.9)
+        while self.total_bytes > target:
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= target:
+                    return
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes,
+        }
+
+
+def enable_llm_cache(path, max_bytes=1 << 30):
+    """Turns on the process-wide cache used by run_llm and prints its counters at exit."""
+    global _DEFAULT_CACHE
+    _DEFAULT_CACHE = LLMCache(path, max_bytes)
+    atexit.register(lambda: print(f"LLM cache stats: {_DEFAULT_CACHE.stats()}"))
+    return _DEFAULT_CACHE
+
+
+def get_llm_cache():
+    return _DEFAULT_CACHE
@@ -1,8 +1,16 @@
 import openai
 import time
 import json
+from llm_cache import enable_llm_cache, get_llm_cache
 
 def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
+    # Keyed on the requested engine, so cache hits skip the model lookup below as well.
+    cache = get_llm_cache()
+    if cache is not None:
+        cached = cache.get(engine, prompt, temperature, max_tokens)
+        if cached is not None:
+            return cached
+    requested_engine = engine
     if "llama" not in engine.lower():
         openai.api_key = "EMPTY"
         openai.api_base = "http://localhost:8000/v1"  # your local llama server port
@@ -14,6 +22,7 @@ def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-tu
     message_prompt = {"role":"user","content":prompt}
     messages.append(message_prompt)
     print("start openai")
+    f = 0
     while(f == 0):
         try:
             response = openai.ChatCompletion.create(
@@ -29,6 +38,8 @@ def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-tu
             print("openai error, retry")
             time.sleep(2)
     print("end openai")
+    if cache is not None:
+        cache.put(requested_engine, prompt, temperature, max_tokens, result)
     return result
 
 def prepare_dataset(dataset_name):
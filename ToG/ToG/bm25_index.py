@@ -0,0 +1,86 @@
+import math
+import re
+import threading
+from collections import Counter
+
+_TOKEN = re.compile(r"[^\W_]+")
+# Process-wide index over the fixed relation vocabulary, see set_bm25_vocabulary().
+_VOCAB_INDEX = None
+_VOCAB_LOCK = threading.Lock()
+
+
+def tokenize(text):
+    """Lower-cased alphanumeric runs, so "people.person.place_of_birth" gives people/person/place/of/birth."""
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 (same formula and idf floor as rank_bm25.BM25Okapi) over a fixed document collection.
+    Term statistics and per-document term weights are computed once, so scoring a candidate subset
+    is a few dict lookups per query term. Documents outside the collection are scored on the fly
+    against the collection statistics.
+    """
+    def __init__(self, corpus, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.b = b
+        corpus = list(dict.fromkeys(corpus))
+        tokenized = [tokenize(doc) for doc in corpus]
+        self.num_docs = len(corpus)
+        self.avgdl = sum(len(tokens) for tokens in tokenized) / self.num_docs if self.num_docs else 0.0
+
+        document_frequency = Counter()
+        for tokens in tokenized:
+            document_frequency.update(set(tokens))
+        self.idf = {}
+        negative = []
+        for term, df in document_frequency.items():
+            idf = math.log(self.num_docs - df + 0.5) - math.log(df + 0.5)
+            self.idf[term] = idf
+            if idf < 0:
+                negative.append(term)
+        # Terms found in more than half of the documents get a small positive idf instead of a negative one.
+        floor = epsilon * sum(self.idf.values()) / len(self.idf) if self.idf else 0.0
+        for term in negative:
+            self.idf[term] = floor
+
+        self.weights = {doc: self._weights(tokens) for doc, tokens in zip(corpus, tokenized)}
+
+    def _weights(self, tokens):
+        """Sparse BM25 vector of one document: term -> idf * saturated term frequency."""
+        length_norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avgdl) if self.avgdl else self.k1
+        return {term: self.idf.get(term, 0.0) * tf * (self.k1 + 1) / (tf + length_norm)
+                for term, tf in Counter(tokens).items()}
+
+    def scores(self, query, docs):
+        """BM25 scores of docs (aligned with docs) for query."""
+        query_terms = tokenize(query)
+        result = []
+        for doc in docs:
+            weights = self.weights.get(doc)
+            if weights is None:
+                weights = self._weights(tokenize(doc))
+            result.append(sum(weights.get(term, 0.0) for term in query_terms))
+        return result
+
+    def top_n(self, query, docs, n):
+        """Returns the n best docs and their scores, best first (ties keep the input order)."""
+        scored = sorted(zip(docs, self.scores(query, docs)), key=lambda pair: -pair[1])[:n]
+        return [doc for doc, _ in scored], [score for _, score in scored]
+
+
+def set_bm25_vocabulary(labels):
+    """Builds the process-wide index over a fixed label vocabulary (e.g. all relation labels)."""
+    global _VOCAB_INDEX
+    index = BM25Index(labels)
+    with _VOCAB_LOCK:
+        _VOCAB_INDEX = index
+    return index
+
+
+def get_bm25_index(docs):
+    """The vocabulary index when it knows every doc, otherwise an index built over docs alone."""
+    index = _VOCAB_INDEX
+    if index is not None and all(doc in index.weights for doc in docs):
+        return index
+    return BM25Index(docs)
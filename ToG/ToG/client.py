@@ -1,4 +1,6 @@
 import itertools
+import threading
+import zlib
 import xmlrpc.client
 import typing as tp
 from dataclasses import dataclass
@@ -8,10 +10,28 @@ import requests
 from bs4 import BeautifulSoup
 
 
+def shard_of(key: str, num_shards: int) -> int:
+    # Same hash as simple_wikidata_db/db_deploy/utils.py, which decides the chunk of each entity at index build time.
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
 class WikidataQueryClient:
     def __init__(self, url: str):
         self.url = url
-        self.server = xmlrpc.client.ServerProxy(url)
+        self._local = threading.local()
+
+    @property
+    def server(self) -> xmlrpc.client.ServerProxy:
+        # ServerProxy keeps one HTTP connection and is not thread-safe, so every thread gets its own.
+        if not hasattr(self._local, "server"):
+            if self.url.startswith("msgpack://"):
+                # Binary transport of server.py --protocol msgpack; msgpack is only needed for these URLs.
+                from msgpack_rpc import MsgpackRPCProxy
+
+                self._local.server = MsgpackRPCProxy(self.url)
+            else:
+                self._local.server = xmlrpc.client.ServerProxy(self.url)
+        return self._local.server
 
     def label2qid(self, label: str) -> str:
         return self.server.label2qid(label)
@@ -94,11 +114,41 @@ class WikidataQueryClient:
     def mid2qid(self, mid: str) -> str:
         return self.server.mid2qid(mid)
 
+    def shard_info(self) -> tp.Dict:
+        return self.server.shard_info()
+
+    def qid2label_batch(self, qids: tp.List[str]) -> tp.List[str]:
+        return self.server.qid2label_batch(qids)
+
+    def get_all_relations_batch(self, entity_qids: tp.List[str]) -> tp.List:
+        return self.server.get_all_relations_batch(entity_qids)
+
+    def get_tail_entities_batch(self, head_relation_pairs: tp.List[tp.List[str]]) -> tp.List:
+        return self.server.get_tail_entities_batch(head_relation_pairs)
+
 
 import time
 import typing as tp
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 
+# Every server loads the full label tables, so any single one can answer these.
+REPLICATED_METHODS = {"label2qid", "label2pid", "pid2label", "qid2label"}
+# Methods whose first argument is the QID (or MID) that decides the owning chunk under the hash partition.
+SHARDED_METHODS = {
+    "get_all_relations_of_an_entity",
+    "get_tail_entities_given_head_and_relation",
+    "get_tail_values_given_head_and_relation",
+    "get_external_id_given_head_and_relation",
+    "mid2qid",
+}
+# Batched server methods and the single-key method each of them stands for.
+BATCH_METHODS = {
+    "qid2label_batch": "qid2label",
+    "get_all_relations_batch": "get_all_relations_of_an_entity",
+    "get_tail_entities_batch": "get_tail_entities_given_head_and_relation",
+}
+
 
 class MultiServerWikidataQueryClient:
     def __init__(self, urls: tp.List[str]):
@@ -109,6 +159,42 @@ class MultiServerWikidataQueryClient:
         # self.test_connections()
         # end_time = time.perf_counter()
         # print(f"Connection testing took {end_time - start_time} seconds")
+        self.shards = self.load_shard_map()
+
+    def load_shard_map(self):
+        """
+        Returns the client serving each chunk when the servers were built with the hash partition and
+        every chunk is up, so QID-keyed queries go to the owning server only. Otherwise returns None,
+        and those queries are sent to all servers.
+        """
+        def get_info(client):
+            try:
+                return client.shard_info()
+            except Exception as e:
+                print(f"No shard info from {client.url}. Error: {str(e)}")
+                return None
+
+        infos = list(self.executor.map(get_info, self.clients))
+        if any(info is None or info["partition"] != "hash" for info in infos):
+            print("Servers are not hash-partitioned, broadcasting entity queries")
+            return None
+        num_chunks = infos[0]["num_chunks"]
+        shards = {}
+        for client, info in zip(self.clients, infos):
+            if info["num_chunks"] == num_chunks:
+                shards.setdefault(info["chunk"], client)
+        if sorted(shards) != list(range(num_chunks)):
+            print(f"Chunks {sorted(shards)} of {num_chunks} are served, broadcasting entity queries")
+            return None
+        return [shards[chunk] for chunk in range(num_chunks)]
+
+    def route(self, method, *args):
+        # Servers to ask: the owning chunk, any single server for label lookups, or all of them.
+        if method in REPLICATED_METHODS:
+            return [self.clients[shard_of(str(args[0]), len(self.clients))]]
+        if self.shards is not None and method in SHARDED_METHODS:
+            return [self.shards[shard_of(str(args[0]), len(self.shards))]]
+        return self.clients
 
     def test_connections(self):
         def test_url(client):
@@ -136,20 +222,25 @@ class MultiServerWikidataQueryClient:
 
     def query_all(self, method, *args):
         start_time = time.perf_counter()
-        futures = [
-            self.executor.submit(getattr(client, method), *args)
-            for client in self.clients
-        ]
+        clients = self.route(method, *args)
+        if len(clients) == 1:
+            results = [getattr(clients[0], method)(*args)]
+        else:
+            futures = [
+                self.executor.submit(getattr(client, method), *args)
+                for client in clients
+            ]
+            results = [f.result() for f in futures]
+        end_time = time.perf_counter()
+        # print(f"HTTP Queries took {end_time - start_time} seconds")
+        return self.merge_results(method, results)
+
+    def merge_results(self, method, results):
         # Retrieve results and filter out 'Not Found!'
         is_dict_return = method in [
             "get_all_relations_of_an_entity",
             "get_tail_entities_given_head_and_relation",
         ]
-        results = [f.result() for f in futures]
-        end_time = time.perf_counter()
-        # print(f"HTTP Queries took {end_time - start_time} seconds")
-
-        start_time = time.perf_counter()
         real_results = (
             set() if not is_dict_return else {"head": [], "tail": []}
         )
@@ -169,11 +260,48 @@ class MultiServerWikidataQueryClient:
                 real_results["tail"].extend(res["tail"])
             else:
                 real_results.add(res)
-        end_time = time.perf_counter()
-        # print(f"Querying all took {end_time - start_time} seconds")
-
         return real_results if len(real_results) > 0 else "Not Found!"
 
+    def query_batch(self, batch_method, keys):
+        """
+        Batched query_all: keys are the arguments of single-key calls (a QID, or a [QID, PID] pair).
+        Every server gets one call with the keys it may own, and the results are merged per key
+        like query_all does. Returns the merged results aligned with keys.
+        """
+        method = BATCH_METHODS[batch_method]
+        groups = defaultdict(list)
+        for position, key in enumerate(keys):
+            qid = key[0] if isinstance(key, (list, tuple)) else key
+            for client in self.route(method, qid):
+                groups[client].append(position)
+        futures = {
+            client: self.executor.submit(
+                getattr(client, batch_method),
+                [list(keys[i]) if isinstance(keys[i], tuple) else keys[i] for i in positions],
+            )
+            for client, positions in groups.items()
+        }
+        results = [[] for _ in keys]
+        for client, positions in groups.items():
+            for position, res in zip(positions, futures[client].result()):
+                results[position].append(res)
+        return [self.merge_results(method, res) for res in results]
+
+    def qid2label_batch(self, qids: tp.List[str]) -> tp.List[str]:
+        """Labels aligned with qids, "Not Found!" for unknown QIDs."""
+        return [
+            res if res == "Not Found!" else res.pop()
+            for res in self.query_batch("qid2label_batch", qids)
+        ]
+
+    def get_all_relations_batch(self, entity_qids: tp.List[str]) -> tp.List[tp.Dict[str, tp.List]]:
+        return self.query_batch("get_all_relations_batch", entity_qids)
+
+    def get_tail_entities_batch(
+        self, head_relation_pairs: tp.List[tp.Tuple[str, str]]
+    ) -> tp.List[tp.Dict[str, tp.List]]:
+        return self.query_batch("get_tail_entities_batch", head_relation_pairs)
+
 
 if __name__ == "__main__":
     import argparse
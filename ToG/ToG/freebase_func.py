@@ -1,4 +1,6 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
+import re
+import threading
+import requests
 from utils import *
 
 SPARQLPATH = "http://192.168.80.12:8890/sparql"  # depend on your own internal address and port, shown in Freebase folder's readme.md
@@ -9,6 +11,19 @@ sparql_tail_relations = """\nPREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?r
 sparql_tail_entities_extract = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?tailEntity\nWHERE {\nns:%s ns:%s ?tailEntity .\n}""" 
 sparql_head_entities_extract = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?tailEntity\nWHERE {\n?tailEntity ns:%s ns:%s  .\n}"""
 sparql_id = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT DISTINCT ?tailEntity\nWHERE {\n  {\n    ?entity ns:type.object.name ?tailEntity .\n    FILTER(?entity = ns:%s)\n  }\n  UNION\n  {\n    ?entity <http://www.w3.org/2002/07/owl#sameAs> ?tailEntity .\n    FILTER(?entity = ns:%s)\n  }\n}"""
+# batched sparqls: VALUES lists many entities (or entity/relation pairs) per round trip
+sparql_relations_batch = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT DISTINCT ?entity ?relation ?isHead\nWHERE {\n  VALUES ?entity { %s }\n  { ?entity ?relation ?x . BIND(1 AS ?isHead) }\n  UNION\n  { ?x ?relation ?entity . BIND(0 AS ?isHead) }\n}"""
+sparql_tail_entities_batch = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?entity ?relation ?tailEntity\nWHERE {\n  VALUES (?entity ?relation) { %s }\n  ?entity ?relation ?tailEntity .\n}"""
+sparql_head_entities_batch = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT ?entity ?relation ?tailEntity\nWHERE {\n  VALUES (?entity ?relation) { %s }\n  ?tailEntity ?relation ?entity .\n}"""
+sparql_id_batch = """PREFIX ns: <http://rdf.freebase.com/ns/>\nSELECT DISTINCT ?entity ?name ?alias\nWHERE {\n  VALUES ?entity { %s }\n  { ?entity ns:type.object.name ?name . }\n  UNION\n  { ?entity <http://www.w3.org/2002/07/owl#sameAs> ?alias . }\n}"""
+FREEBASE_PREFIX = "http://rdf.freebase.com/ns/"
+# Entities (or entity/relation pairs) per VALUES clause, keeping each query well under Virtuoso's limits.
+SPARQL_BATCH_SIZE = 200
+# ResultSetMaxRows of the endpoint (10000 in the sample virtuoso.ini): a result this long may have been cut off.
+SPARQL_MAX_ROWS = 10000
+# Rows read page by page for a single entity (or pair) whose result alone fills SPARQL_MAX_ROWS.
+SPARQL_MAX_KEY_ROWS = 100000
+_SPARQL_CONFIG = {"batch_size": SPARQL_BATCH_SIZE, "max_rows": SPARQL_MAX_ROWS, "max_key_rows": SPARQL_MAX_KEY_ROWS}
     
 def check_end_word(s):
     words = [" ID", " code", " number", "instance of", "website", "URL", "inception", "image", " rate", " count"]
@@ -19,12 +34,108 @@ def abandon_rels(relation):
         return True
 
 
+class SparqlClient:
+    """
+    SPARQL-over-HTTP client of the Virtuoso endpoint. Each thread keeps its own requests.Session,
+    so connections are reused (keep-alive) without sharing a session between threads.
+    """
+    def __init__(self, endpoint, timeout=60):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def query(self, sparql_query):
+        response = self.session.post(
+            self.endpoint,
+            data={"query": sparql_query},
+            headers={"Accept": "application/sparql-results+json"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()["results"]["bindings"]
+
+
+_SPARQL_CLIENT = SparqlClient(SPARQLPATH)
+# mid -> name cache; Freebase names do not change during a run. Cleared when it grows past the limit.
+_NAME_CACHE = {}
+_NAME_CACHE_LOCK = threading.Lock()
+_NAME_CACHE_MAX = 1000000
+
+
 def execurte_sparql(sparql_query):
-    sparql = SPARQLWrapper(SPARQLPATH)
-    sparql.setQuery(sparql_query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-    return results["results"]["bindings"]
+    return _SPARQL_CLIENT.query(sparql_query)
+
+
+def configure_sparql(**config):
+    """Sets batch_size, max_rows or max_key_rows for the batched queries."""
+    unknown = set(config) - set(_SPARQL_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown SPARQL options: {sorted(unknown)}")
+    _SPARQL_CONFIG.update(config)
+
+
+def add_sparql_args(parser):
+    parser.add_argument("--sparql_batch_size", type=int,
+                        default=SPARQL_BATCH_SIZE, help="entities (or entity/relation pairs) per batched SPARQL query.")
+    parser.add_argument("--sparql_max_rows", type=int,
+                        default=SPARQL_MAX_ROWS, help="ResultSetMaxRows of the Virtuoso endpoint; results this long are re-queried in smaller batches.")
+    parser.add_argument("--sparql_max_key_rows", type=int,
+                        default=SPARQL_MAX_KEY_ROWS, help="rows read page by page for one entity or entity/relation pair over sparql_max_rows.")
+
+
+def configure_sparql_from_args(args):
+    configure_sparql(batch_size=args.sparql_batch_size, max_rows=args.sparql_max_rows, max_key_rows=args.sparql_max_key_rows)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _query_pages(sparql_query):
+    """
+    Reads the rows of a query over one entity (or pair) page by page. Virtuoso only pages a sorted
+    result past ResultSetMaxRows when the ORDER BY is in a subquery.
+    """
+    prefix, body = sparql_query.split("\n", 1)
+    order = re.search(r"SELECT\s+(?:DISTINCT\s+)?(.*)", body).group(1)
+    max_rows, max_key_rows = _SPARQL_CONFIG["max_rows"], _SPARQL_CONFIG["max_key_rows"]
+    rows = []
+    while len(rows) < max_key_rows:
+        page = execurte_sparql(f"{prefix}\nSELECT * WHERE {{\n{{ {body}\nORDER BY {order} }}\n}}\nLIMIT {max_rows} OFFSET {len(rows)}")
+        rows.extend(page)
+        if len(page) < max_rows:
+            return rows
+    print(f"Warning: SPARQL result cut off after {len(rows)} rows: {sparql_query}")
+    return rows[:max_key_rows]
+
+
+def _query_values(template, keys, render):
+    """
+    Runs template with VALUES lists of up to batch_size keys, rendered by render, and returns all rows.
+    A result of max_rows rows may have been cut off by the endpoint, letting one large entity crowd out
+    the others: its chunk is split in halves and re-queried, and a single key is read page by page.
+    """
+    rows = []
+    pending = list(_chunks(keys, _SPARQL_CONFIG["batch_size"]))[::-1]
+    while pending:
+        chunk = pending.pop()
+        sparql_query = template % " ".join(render(key) for key in chunk)
+        result = execurte_sparql(sparql_query)
+        if len(result) < _SPARQL_CONFIG["max_rows"]:
+            rows.extend(result)
+        elif len(chunk) > 1:
+            half = len(chunk) // 2
+            pending += [chunk[half:], chunk[:half]]
+        else:
+            rows.extend(_query_pages(sparql_query))
+    return rows
 
 
 def replace_relation_prefix(relations):
@@ -34,16 +145,61 @@ def replace_entities_prefix(entities):
     return [entity['tailEntity']['value'].replace("http://rdf.freebase.com/ns/","") for entity in entities]
 
 
+def entity_names(entity_ids):
+    """Returns {mid: name or "UnName_Entity"}, querying only uncached mids, batch_size per round trip."""
+    with _NAME_CACHE_LOCK:
+        names = {entity_id: _NAME_CACHE[entity_id] for entity_id in entity_ids if entity_id in _NAME_CACHE}
+    missing = list(dict.fromkeys(entity_id for entity_id in entity_ids if entity_id not in names))
+    found, aliases = {}, {}
+    for row in _query_values(sparql_id_batch, missing, lambda entity_id: "ns:" + entity_id):
+        entity_id = row['entity']['value'].replace(FREEBASE_PREFIX, "")
+        # Like the single-entity query, the first binding wins; a name is preferred over a sameAs alias.
+        if 'name' in row:
+            found.setdefault(entity_id, row['name']['value'])
+        elif 'alias' in row:
+            aliases.setdefault(entity_id, row['alias']['value'])
+    for entity_id in missing:
+        names[entity_id] = found.get(entity_id) or aliases.get(entity_id) or "UnName_Entity"
+    if missing:
+        with _NAME_CACHE_LOCK:
+            if len(_NAME_CACHE) > _NAME_CACHE_MAX:
+                _NAME_CACHE.clear()
+            _NAME_CACHE.update((entity_id, names[entity_id]) for entity_id in missing)
+    return names
+
+
 def id2entity_name_or_type(entity_id):
-    sparql_query = sparql_id % (entity_id, entity_id)
-    sparql = SPARQLWrapper(SPARQLPATH)
-    sparql.setQuery(sparql_query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-    if len(results["results"]["bindings"])==0:
-        return "UnName_Entity"
-    else:
-        return results["results"]["bindings"][0]['tailEntity']['value']
+    return entity_names([entity_id])[entity_id]
+
+
+def entity_relations_batch(entity_ids):
+    """Returns {mid: (head relations, tail relations)} for all mids with one UNION query per chunk."""
+    relations = {entity_id: ([], []) for entity_id in entity_ids}
+    for row in _query_values(sparql_relations_batch, list(relations), lambda entity_id: "ns:" + entity_id):
+        entity_id = row['entity']['value'].replace(FREEBASE_PREFIX, "")
+        relation = row['relation']['value'].replace(FREEBASE_PREFIX, "")
+        relations[entity_id][0 if int(row['isHead']['value']) else 1].append(relation)
+    return relations
+
+
+def entity_search_batch(requests_list):
+    """
+    Batched entity_search: requests_list holds (entity, relation, head) tuples; returns the candidate
+    mid lists in the same order, with one query per direction and chunk.
+    """
+    results = [[] for _ in requests_list]
+    for head, template in ((True, sparql_tail_entities_batch), (False, sparql_head_entities_batch)):
+        positions = {}
+        for i, (entity, relation, is_head) in enumerate(requests_list):
+            if bool(is_head) == head:
+                positions.setdefault((entity, relation), []).append(i)
+        for row in _query_values(template, list(positions), lambda pair: "(ns:%s ns:%s)" % pair):
+            key = (row['entity']['value'].replace(FREEBASE_PREFIX, ""), row['relation']['value'].replace(FREEBASE_PREFIX, ""))
+            candidate = row['tailEntity']['value'].replace(FREEBASE_PREFIX, "")
+            if candidate.startswith("m."):
+                for i in positions.get(key, []):
+                    results[i].append(candidate)
+    return results
     
 from freebase_func import *
 from prompt_list import *
@@ -103,14 +259,11 @@ def construct_entity_score_prompt(question, relation, entity_candidates):
     return score_entity_candidates_prompt.format(question, relation) + "; ".join(entity_candidates) + '\nScore: '
 
 
-def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args):
-    sparql_relations_extract_head = sparql_head_relations % (entity_id)
-    head_relations = execurte_sparql(sparql_relations_extract_head)
-    head_relations = replace_relation_prefix(head_relations)
-    
-    sparql_relations_extract_tail= sparql_tail_relations % (entity_id)
-    tail_relations = execurte_sparql(sparql_relations_extract_tail)
-    tail_relations = replace_relation_prefix(tail_relations)
+def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, relations=None):
+    """relations: optional (head, tail) relation lists prefetched with entity_relations_batch."""
+    if relations is None:
+        relations = entity_relations_batch([entity_id])[entity_id]
+    head_relations, tail_relations = relations
 
     if args.remove_unnecessary_rel:
         head_relations = [relation for relation in head_relations if not abandon_rels(relation)]
@@ -136,8 +289,7 @@ def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, quest
         topn_relations, topn_scores = compute_bm25_similarity(question, total_relations, args.width)
         flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations) 
     else:
-        model = SentenceTransformer('sentence-transformers/msmarco-distilbert-base-tas-b')
-        topn_relations, topn_scores = retrieve_top_docs(question, total_relations, model, args.width)
+        topn_relations, topn_scores = retrieve_top_docs(question, total_relations, args.width)
         flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations) 
 
     if flag:
@@ -161,7 +313,8 @@ def entity_search(entity, relation, head=True):
 
 
 def entity_score(question, entity_candidates_id, score, relation, args):
-    entity_candidates = [id2entity_name_or_type(entity_id) for entity_id in entity_candidates_id]
+    names = entity_names(entity_candidates_id)
+    entity_candidates = [names[entity_id] for entity_id in entity_candidates_id]
     if all_unknown_entity(entity_candidates):
         return [1/len(entity_candidates) * score] * len(entity_candidates), entity_candidates, entity_candidates_id
     entity_candidates = del_unknown_entity(entity_candidates)
@@ -182,13 +335,13 @@ def entity_score(question, entity_candidates_id, score, relation, args):
         return [float(x) * score for x in clean_scores(result, entity_candidates)], entity_candidates, entity_candidates_id
 
     elif args.prune_tools == "bm25":
-        topn_entities, topn_scores = compute_bm25_similarity(question, entity_candidates, args.width)
+        entity_scores = bm25_scores(question, entity_candidates)
     else:
-        model = SentenceTransformer('sentence-transformers/msmarco-distilbert-base-tas-b')
-        topn_entities, topn_scores = retrieve_top_docs(question, entity_candidates, model, args.width)
-    if if_all_zero(topn_scores):
-        topn_scores = [float(1/len(topn_scores))] * len(topn_scores)
-    return [float(x) * score for x in topn_scores], topn_entities, entity_candidates_id
+        entity_scores = sentence_scores(question, entity_candidates)
+    # Every candidate keeps its own score (aligned with entity_candidates_id); entity_prune picks the top width.
+    if if_all_zero(entity_scores):
+        entity_scores = [float(1/len(entity_scores))] * len(entity_scores)
+    return [float(x) * score for x in entity_scores], entity_candidates, entity_candidates_id
 
     
 def update_history(entity_candidates, entity, scores, entity_candidates_id, total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head):
@@ -233,7 +386,8 @@ def entity_prune(total_entities_id, total_relations, total_candidates, total_top
         return False, [], [], [], []
     entities_id, relations, candidates, tops, heads, scores = map(list, zip(*filtered_list))
 
-    tops = [id2entity_name_or_type(entity_id) for entity_id in tops]
+    names = entity_names(tops)
+    tops = [names[entity_id] for entity_id in tops]
     cluster_chain_of_entities = [[(tops[i], relations[i], candidates[i]) for i in range(len(candidates))]]
     return True, cluster_chain_of_entities, entities_id, relations, heads
 
@@ -6,22 +6,15 @@ def id2entity_name_or_type(entity_id, id2entity_map):
     # The keys in the map might be strings, so we ensure we look up with a string
     return id2entity_map.get(str(entity_id), "Unknown_Entity")
 
-def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, graph, id2relation_map, id2vertex_map):
+def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, adjacency, id2relation_map, id2vertex_map):
     vertex_index = id2vertex_map.get(entity_id)
     if vertex_index is None:
         print(f"Warning: Entity ID {entity_id} not found in vertex map.")
         return []
-    
-    vertex = graph.vertex(vertex_index)
-    
-    head_relations, tail_relations = set(), set()
-    relation_property = graph.edge_properties.get("relation")
-    if not relation_property: return []
 
-    for edge in vertex.out_edges():
-        head_relations.add(id2relation_map.get(str(relation_property[edge])))
-    for edge in vertex.in_edges():
-        tail_relations.add(id2relation_map.get(str(relation_property[edge])))
+    # Distinct relations of a vertex are a contiguous slice of the CSR relation groups.
+    head_relations = {id2relation_map.get(str(r)) for r in adjacency.relations(vertex_index, True).tolist()}
+    tail_relations = {id2relation_map.get(str(r)) for r in adjacency.relations(vertex_index, False).tolist()}
 
     if pre_relations:
         if pre_head is not None and pre_head:
@@ -37,31 +30,25 @@ def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, quest
         prompt = construct_relation_prune_prompt(question, entity_name, total_relations, args)
         result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type)
         flag, retrieve_relations_with_scores = clean_relations(result, entity_id, head_relations)
-    # ... (other prune tools logic can be added here)
+    elif args.prune_tools == "bm25":
+        topn_relations, topn_scores = compute_bm25_similarity(question, total_relations, args.width)
+        flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations)
+    elif args.prune_tools == "sentencebert":
+        topn_relations, topn_scores = retrieve_top_docs(question, total_relations, args.width)
+        flag, retrieve_relations_with_scores = clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relations)
 
     return retrieve_relations_with_scores if flag else []
 
-def entity_search(entity_id, relation_name, is_head, graph, relation2id_map, id2vertex_map):
-    candidate_entity_ids = []
+def entity_search(entity_id, relation_name, is_head, adjacency, relation2id_map, id2vertex_map, vertex2id_map):
     relation_id = relation2id_map.get(relation_name)
     if relation_id is None: return []
 
     vertex_index = id2vertex_map.get(entity_id)
     if vertex_index is None: return []
-    
-    vertex = graph.vertex(vertex_index)
-    
-    relation_property = graph.edge_properties["relation"]
-    vertex2id_map = {v: k for k, v in id2vertex_map.items()}
 
-    if is_head:
-        for edge in vertex.out_edges():
-            if relation_property[edge] == relation_id:
-                candidate_entity_ids.append(vertex2id_map.get(int(edge.target())))
-    else:
-        for edge in vertex.in_edges():
-            if relation_property[edge] == relation_id:
-                candidate_entity_ids.append(vertex2id_map.get(int(edge.source())))
+    # Neighbours via one relation are a single CSR slice; vertex2id_map is indexed by vertex.
+    neighbors = adjacency.neighbors(vertex_index, relation_id, is_head)
+    candidate_entity_ids = [vertex2id_map[v] for v in neighbors.tolist()]
 
     return [eid for eid in candidate_entity_ids if eid is not None]
 
@@ -92,6 +79,15 @@ def entity_score(question, entity_candidates_id, base_score, relation, args, id2
         result = run_llm(prompt, args.temperature_exploration, args.max_length, args.opeani_api_keys, args.LLM_type)
         scores = [float(x) * base_score for x in clean_scores(result, entity_candidates_names)]
         return scores, entity_candidates_names, entity_candidates_id
+    elif args.prune_tools in ("bm25", "sentencebert"):
+        # Local scoring, no LLM call; scores stay aligned with the candidates.
+        if args.prune_tools == "bm25":
+            scores = bm25_scores(question, entity_candidates_names)
+        else:
+            scores = sentence_scores(question, entity_candidates_names)
+        if if_all_zero(scores):
+            scores = [1.0 / len(scores)] * len(scores)
+        return [float(x) * base_score for x in scores], entity_candidates_names, entity_candidates_id
     else:
         # Fallback for other pruning tools
         scores = [base_score / len(entity_candidates_names)] * len(entity_candidates_names)
@@ -130,9 +126,9 @@ def update_history(entity_candidates, entity, scores, entity_candidates_id, tota
     return total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head
 
 def half_stop(question, cluster_chain_of_entities, depth, args):
+    # Returns the answer instead of saving it, so the caller controls (ordered) result writing.
     print(f"No new knowledge added during search depth {depth}, stop searching.")
-    answer = generate_answer(question, cluster_chain_of_entities, args)
-    save_2_jsonl(question, answer, cluster_chain_of_entities, file_name=args.dataset)
+    return generate_answer(question, cluster_chain_of_entities, args)
 
 def generate_answer(question, cluster_chain_of_entities, args): 
     prompt = answer_prompt + question + '\n'
@@ -0,0 +1,251 @@
+import os
+from collections.abc import Mapping
+import numpy as np
+
+CSR_DIR_NAME = "csr"
+CSR_ARRAYS = ["vertex_offsets", "group_relations", "group_offsets", "neighbors"]
+MAPS_DIR_NAME = "maps"
+
+
+class RelationCSR:
+    """
+    Adjacency of one edge direction, grouped by (vertex, relation).
+
+    For vertex v, groups vertex_offsets[v]:vertex_offsets[v+1] are its distinct relations
+    (sorted by relation id), and neighbours of group k are neighbors[group_offsets[k]:group_offsets[k+1]]
+    (in original edge order).
+    """
+    def __init__(self, vertex_offsets, group_relations, group_offsets, neighbors):
+        self.vertex_offsets = vertex_offsets
+        self.group_relations = group_relations
+        self.group_offsets = group_offsets
+        self.neighbors = neighbors
+
+    @property
+    def num_vertices(self):
+        return len(self.vertex_offsets) - 1
+
+    def relations(self, vertex_index):
+        return self.group_relations[self.vertex_offsets[vertex_index]:self.vertex_offsets[vertex_index + 1]]
+
+    def neighbors_via(self, vertex_index, relation_id):
+        start, end = self.vertex_offsets[vertex_index], self.vertex_offsets[vertex_index + 1]
+        group = start + np.searchsorted(self.group_relations[start:end], relation_id)
+        if group >= end or self.group_relations[group] != relation_id:
+            return self.neighbors[:0]
+        return self.neighbors[self.group_offsets[group]:self.group_offsets[group + 1]]
+
+
+def build_relation_csr(sources, targets, relations, num_vertices):
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    relations = np.asarray(relations, dtype=np.int64)
+    # lexsort is stable, so edges inside a (vertex, relation) group keep their insertion order.
+    order = np.lexsort((relations, sources))
+    sources, relations, targets = sources[order], relations[order], targets[order]
+
+    num_edges = len(sources)
+    if num_edges:
+        boundaries = np.flatnonzero((sources[1:] != sources[:-1]) | (relations[1:] != relations[:-1])) + 1
+        group_starts = np.concatenate(([0], boundaries))
+    else:
+        group_starts = np.zeros(0, dtype=np.int64)
+
+    group_offsets = np.append(group_starts, num_edges).astype(np.int64)
+    group_relations = relations[group_starts].astype(np.int32)
+    vertex_offsets = np.searchsorted(sources[group_starts], np.arange(num_vertices + 1)).astype(np.int64)
+    return RelationCSR(vertex_offsets, group_relations, group_offsets, targets.astype(np.int32))
+
+
+class GRBenchAdjacency:
+    """Out-edge (head) and in-edge (tail) CSR layouts of a GRBench graph."""
+    def __init__(self, out_csr, in_csr):
+        self.out_csr = out_csr
+        self.in_csr = in_csr
+
+    @property
+    def num_vertices(self):
+        return self.out_csr.num_vertices
+
+    @property
+    def num_edges(self):
+        return len(self.out_csr.neighbors)
+
+    def csr(self, is_head):
+        return self.out_csr if is_head else self.in_csr
+
+    def relations(self, vertex_index, is_head=True):
+        return self.csr(is_head).relations(vertex_index)
+
+    def neighbors(self, vertex_index, relation_id, is_head=True):
+        return self.csr(is_head).neighbors_via(vertex_index, relation_id)
+
+
+def build_adjacency(sources, targets, relations, num_vertices):
+    out_csr = build_relation_csr(sources, targets, relations, num_vertices)
+    in_csr = build_relation_csr(targets, sources, relations, num_vertices)
+    return GRBenchAdjacency(out_csr, in_csr)
+
+
+def build_adjacency_from_graph(graph):
+    """Builds the CSR layout from a loaded graph_tool graph carrying a "relation" edge property."""
+    edges = graph.get_edges([graph.edge_properties["relation"]])
+    return build_adjacency(edges[:, 0], edges[:, 1], edges[:, 2], graph.num_vertices())
+
+
+def save_adjacency(adjacency, output_dir):
+    csr_dir = os.path.join(output_dir, CSR_DIR_NAME)
+    os.makedirs(csr_dir, exist_ok=True)
+    for direction, csr in (("out", adjacency.out_csr), ("in", adjacency.in_csr)):
+        for name in CSR_ARRAYS:
+            np.save(os.path.join(csr_dir, f"{direction}_{name}.npy"), getattr(csr, name))
+
+
+def load_adjacency(processed_dir, mmap_mode='r'):
+    """Memory-maps the CSR arrays written by save_adjacency. Returns None if they are missing."""
+    csr_dir = os.path.join(processed_dir, CSR_DIR_NAME)
+    if not os.path.isdir(csr_dir):
+        return None
+    layouts = []
+    for direction in ("out", "in"):
+        arrays = [np.load(os.path.join(csr_dir, f"{direction}_{name}.npy"), mmap_mode=mmap_mode) for name in CSR_ARRAYS]
+        layouts.append(RelationCSR(*arrays))
+    return GRBenchAdjacency(*layouts)
+
+
+class StringTable:
+    """
+    Read-only sequence of strings stored as one UTF-8 blob plus offsets, optionally with
+    a sort permutation (order) so that find() can binary search without decoding the table.
+    """
+    def __init__(self, data, offsets, order=None):
+        self.data = data
+        self.offsets = offsets
+        self.order = order
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def find(self, key, last=False):
+        """Returns the index of key (the first or last of equal strings), or None."""
+        if self.order is None:
+            raise ValueError("StringTable was saved without a sorted index.")
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self[int(self.order[mid])]
+            if value < key or (last and value == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        position = lo - 1 if last else lo
+        if 0 <= position < len(self.order) and self[int(self.order[position])] == key:
+            return int(self.order[position])
+        return None
+
+
+def save_string_table(strings, maps_dir, name, sorted_index=True):
+    os.makedirs(maps_dir, exist_ok=True)
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(maps_dir, f"{name}.data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(maps_dir, f"{name}.offsets.npy"), offsets)
+    if sorted_index:
+        # sorted() is stable, so equal strings keep their original (vertex) order.
+        order = np.array(sorted(range(len(strings)), key=strings.__getitem__), dtype=np.int64)
+        np.save(os.path.join(maps_dir, f"{name}.order.npy"), order)
+
+
+def load_string_table(maps_dir, name, mmap_mode='r'):
+    data = np.load(os.path.join(maps_dir, f"{name}.data.npy"), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(maps_dir, f"{name}.offsets.npy"), mmap_mode=mmap_mode)
+    order_path = os.path.join(maps_dir, f"{name}.order.npy")
+    order = np.load(order_path, mmap_mode=mmap_mode) if os.path.exists(order_path) else None
+    return StringTable(data, offsets, order)
+
+
+class EntityVertexMap(Mapping):
+    """entity id -> vertex index, backed by the entity id table."""
+    def __init__(self, entity_ids):
+        self.entity_ids = entity_ids
+
+    def __getitem__(self, entity_id):
+        vertex_index = self.entity_ids.find(str(entity_id))
+        if vertex_index is None:
+            raise KeyError(entity_id)
+        return vertex_index
+
+    def __iter__(self):
+        return iter(self.entity_ids)
+
+    def __len__(self):
+        return len(self.entity_ids)
+
+
+class EntityNameMap(Mapping):
+    """entity id -> entity name."""
+    def __init__(self, entity_ids, entity_names):
+        self.vertex_map = EntityVertexMap(entity_ids)
+        self.entity_names = entity_names
+
+    def __getitem__(self, entity_id):
+        return self.entity_names[self.vertex_map[entity_id]]
+
+    def __iter__(self):
+        return iter(self.vertex_map)
+
+    def __len__(self):
+        return len(self.vertex_map)
+
+
+class NameEntityMap(Mapping):
+    """entity name -> entity id. Duplicate names resolve to the last entity, like a dict built from the JSON map."""
+    def __init__(self, entity_ids, entity_names):
+        self.entity_ids = entity_ids
+        self.entity_names = entity_names
+
+    def __getitem__(self, name):
+        vertex_index = self.entity_names.find(name, last=True)
+        if vertex_index is None:
+            raise KeyError(name)
+        return self.entity_ids[vertex_index]
+
+    def __iter__(self):
+        return iter(dict.fromkeys(self.entity_names))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def save_grbench_maps(entity_ids, entity_names, relation_names, output_dir):
+    """entity_ids/entity_names are in vertex order, relation_names in relation id order."""
+    maps_dir = os.path.join(output_dir, MAPS_DIR_NAME)
+    save_string_table(entity_ids, maps_dir, "entity_ids")
+    save_string_table(entity_names, maps_dir, "entity_names")
+    save_string_table(relation_names, maps_dir, "relation_names", sorted_index=False)
+
+
+def load_grbench_maps(maps_dir):
+    """
+    Memory-maps the tables written by save_grbench_maps. Returns
+    (id2entity_map, id2relation_map, id2vertex_map, vertex2id_map, name2id_map), or None if missing.
+    """
+    if not os.path.isdir(maps_dir):
+        return None
+    entity_ids = load_string_table(maps_dir, "entity_ids")
+    entity_names = load_string_table(maps_dir, "entity_names")
+    relation_names = load_string_table(maps_dir, "relation_names")
+    # The relation vocabulary is tiny, so it is kept as a plain dict keyed like the JSON map.
+    id2relation_map = {str(relation_id): name for relation_id, name in enumerate(relation_names)}
+    return (EntityNameMap(entity_ids, entity_names), id2relation_map, EntityVertexMap(entity_ids),
+            entity_ids, NameEntityMap(entity_ids, entity_names))
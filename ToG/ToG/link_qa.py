@@ -2,10 +2,14 @@ import json
 import argparse
 import os
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import jsonlines
-from openai import OpenAI
 import traceback # Import the traceback module
+from grbench_index import load_grbench_maps
+from llm_client import configure_llm_client, get_llm_client, ERROR_RESPONSE
+from name_index import build_name_index, load_name_index, extract_topic_entity_from_question, REGEX_MIN_SCORE
 
 # --- SCRIPT VERSION IDENTIFIER ---
 print("--- Running link_qa_final_debug.py (Version 4.0 - Final) ---")
@@ -33,80 +37,224 @@ Question: "{question}"
 Answer:
 """
 
-def get_entity_from_llm(client: OpenAI, question: str, model: str):
+# Several questions per request: the answers come back as one JSON object keyed by question number.
+BATCH_PROMPT_TEMPLATE = """
+Your task is to accurately extract the core topic entity name from each of the user's questions below.
+You need to understand the user's intent and return only the entity name itself, without extra words like "brand of" or "item".
+Please strictly return the result in the JSON format {{"results": [{{"id": 1, "entity_name": "..."}}, ...]}} with one entry per question, using the question numbers as ids. If no clear entity is present in a question, use "entity_name": null.
+
+---
+[Example]
+Questions:
+1. "Could you specify the brand of Blackberry Playbook 7-Inch Tablet (64GB)?"
+2. "What brand does the item Sassy Developmental Bath Toy, Catch and Count Net belong to?"
+Answer: {{"results": [{{"id": 1, "entity_name": "Blackberry Playbook 7-Inch Tablet (64GB)"}}, {{"id": 2, "entity_name": "Sassy Developmental Bath Toy, Catch and Count Net"}}]}}
+
+---
+[New Questions]
+Questions:
+{questions}
+Answer:
+"""
+
+# Output budget per question; entity names are rarely longer than a few dozen tokens.
+MAX_TOKENS_PER_QUESTION = 96
+# Returned for a question whose extraction request failed, as opposed to None for "no entity in the question".
+LLM_FAILED = object()
+
+def request_json(client, prompt, model, max_tokens):
+    """Sends one JSON-mode request (with the client's retries and backoff). Returns the parsed object or None."""
+    content = client.chat(prompt, 0, max_tokens, model, response_format={"type": "json_object"})
+    if not content or content == ERROR_RESPONSE:
+        return None
+    try:
+        result = json.loads(content)
+    except ValueError:
+        print(f"Could not parse the JSON returned by the API: {content}")
+        return None
+    return result if isinstance(result, dict) else None
+
+def get_entity_from_llm(client, question: str, model: str):
     # This function should now work correctly
     prompt = PROMPT_TEMPLATE.format(question=question)
-    content_for_debugging = ""
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        content_for_debugging = response.choices[0].message.content
-        if not content_for_debugging:
-            return None 
-        result = json.loads(content_for_debugging)
-        if not isinstance(result, dict):
-            return None
-        return result.get("entity_name")
+        result = request_json(client, prompt, model, MAX_TOKENS_PER_QUESTION)
+        return result.get("entity_name") if result else LLM_FAILED
     except Exception as e:
         print("\n--- ERROR INSIDE get_entity_from_llm ---")
         print(f"An error occurred while processing the question: '{question}'")
-        print(f"Raw content received from API: {content_for_debugging}")
         print("Full Traceback:")
         traceback.print_exc()
         print("-----------------------------------------")
-        return None
+        return LLM_FAILED
+
+def get_entities_from_llm(client, questions, model):
+    """
+    Extracts the entity names of several questions with one request. Questions missing from the
+    batched answer are retried one at a time, so the result always has one entry per question
+    (LLM_FAILED where the retry failed too).
+    """
+    if len(questions) == 1:
+        return [get_entity_from_llm(client, questions[0], model)]
+    numbered = "\n".join(f'{i}. {json.dumps(question, ensure_ascii=False)}' for i, question in enumerate(questions, 1))
+    prompt = BATCH_PROMPT_TEMPLATE.format(questions=numbered)
+    names = {}
+    try:
+        result = request_json(client, prompt, model, MAX_TOKENS_PER_QUESTION * len(questions))
+        for entry in (result or {}).get("results") or []:
+            if isinstance(entry, dict) and "id" in entry:
+                names[str(entry["id"])] = entry.get("entity_name")
+    except Exception:
+        print("\n--- ERROR INSIDE get_entities_from_llm ---")
+        traceback.print_exc()
+    return [names[str(i)] if str(i) in names else get_entity_from_llm(client, question, model)
+            for i, question in enumerate(questions, 1)]
+
+class EntityLinker:
+    """Resolves names to entity ids through the exact name map, then the fuzzy name index (if any)."""
+    def __init__(self, name2id, id2name, name_index=None, min_score=0.5):
+        self.name2id = name2id
+        self.id2name = id2name
+        self.name_index = name_index
+        self.min_score = min_score
+
+    def resolve(self, name, min_score=None):
+        if not name:
+            return None
+        entity_id = self.name2id.get(name)
+        if entity_id:
+            return entity_id
+        if self.name_index is None:
+            return None
+        match = self.name_index.lookup(name, self.min_score if min_score is None else min_score)
+        return match[0] if match else None
+
+    def resolve_with_regex(self, question):
+        return self.resolve(extract_topic_entity_from_question(question), REGEX_MIN_SCORE)
+
+    def find_in_question(self, question):
+        if self.name_index is None:
+            return None
+        match = self.name_index.find_in_text(question)
+        return match[0] if match else None
+
+def link_items(client, items, model, linker, question_fallback=False):
+    """
+    Links a chunk of QA items in place and returns (items, number of linked items, number of LLM-linked questions).
+    Questions whose regex-extracted name resolves locally skip the LLM; LLM names that are not exact
+    entity names go through the fuzzy index. The whole question is matched against entity names only
+    when the LLM request failed, or with question_fallback also when the LLM name did not resolve.
+    Every linked item records how it was linked in 'link_source'.
+    """
+    def link(item, entity_id, source):
+        item['topic_entity_id'] = entity_id
+        item['topic_entity_name'] = linker.id2name[entity_id]
+        item['link_source'] = source
+
+    linked = 0
+    llm_items = []
+    for item in items:
+        question = item.get('question')
+        if not question:
+            continue
+        entity_id = linker.resolve_with_regex(question)
+        if entity_id:
+            link(item, entity_id, "regex")
+            linked += 1
+        else:
+            llm_items.append(item)
+
+    extracted_names = get_entities_from_llm(client, [item['question'] for item in llm_items], model) if llm_items else []
+    for item, extracted_name in zip(llm_items, extracted_names):
+        failed = extracted_name is LLM_FAILED
+        entity_id = None if failed else linker.resolve(extracted_name)
+        if entity_id:
+            link(item, entity_id, "llm")
+        elif failed or question_fallback:
+            entity_id = linker.find_in_question(item['question'])
+            if entity_id:
+                link(item, entity_id, "question_fallback")
+        if entity_id:
+            linked += 1
+    return items, linked, len(llm_items)
 
-def link_qa_data_with_api(qa_path, entity_name_path, output_path, model, client):
+def read_chunks(reader, chunk_size):
+    chunk = []
+    for item in reader:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def link_qa_data_with_api(qa_path, entity_name_path, output_path, model, client, maps_dir=None,
+                          questions_per_request=1, max_in_flight=8, name_index_dir=None, min_fuzzy_score=0.5,
+                          question_fallback=False):
     print("Step 1: Loading entity name maps for final linking...")
     try:
-        with open(entity_name_path, 'r', encoding='utf-8') as f:
-            id2name = json.load(f)
-        name2id = {name: id for id, name in id2name.items()}
-        print(f"Loaded {len(name2id)} unique entity names.")
+        maps = load_grbench_maps(maps_dir) if maps_dir else None
+        if maps is not None:
+            # Binary maps are memory-mapped and looked up lazily, no full dict is built.
+            id2name, name2id = maps[0], maps[4]
+            print(f"Using binary entity maps from {maps_dir}.")
+        else:
+            with open(entity_name_path, 'r', encoding='utf-8') as f:
+                id2name = json.load(f)
+            name2id = {name: id for id, name in id2name.items()}
+            print(f"Loaded {len(name2id)} unique entity names.")
     except FileNotFoundError:
         print(f"Error: Entity name file not found at {entity_name_path}")
         return
 
-    print(f"Step 2: Processing QA data with model '{model}'...")
+    name_index = load_name_index(name_index_dir) if name_index_dir else None
+    if name_index is None:
+        print("Name index not found, building it in memory...")
+        if maps is not None:
+            name_index = build_name_index(list(maps[3]), list(maps[0].entity_names))
+        else:
+            name_index = build_name_index(list(id2name.keys()), list(id2name.values()))
+    linker = EntityLinker(name2id, id2name, name_index, min_fuzzy_score)
+
+    print(f"Step 2: Processing QA data with model '{model}' ({questions_per_request} questions per request, {max_in_flight} requests in flight)...")
     successful_links = 0
     total_questions = 0
+    llm_questions = 0
 
     try:
+        # Items are read and written as a stream. At most max_in_flight chunks are pending at once,
+        # and they are written back in input order.
         with jsonlines.open(qa_path, mode='r') as reader, \
-             jsonlines.open(output_path, mode='w') as writer:
-            qa_items = list(reader)
-            total_questions = len(qa_items)
-
-            for item in tqdm(qa_items, desc="Linking Entities with API"):
-                question = item.get('question')
-                if not question:
-                    writer.write(item)
-                    continue
-
-                extracted_name = get_entity_from_llm(client, question, model)
-                
-                if extracted_name:
-                    entity_id = name2id.get(extracted_name)
-                    if entity_id:
-                        item['topic_entity_id'] = entity_id
-                        item['topic_entity_name'] = extracted_name
-                        successful_links += 1
-                
-                writer.write(item)
+             jsonlines.open(output_path, mode='w') as writer, \
+             ThreadPoolExecutor(max_workers=max_in_flight) as executor, \
+             tqdm(desc="Linking Entities with API", unit="question") as progress:
+            pending = deque()
+
+            def write_oldest():
+                nonlocal successful_links, total_questions, llm_questions
+                items, linked, sent_to_llm = pending.popleft().result()
+                writer.write_all(items)
+                successful_links += linked
+                llm_questions += sent_to_llm
+                total_questions += len(items)
+                progress.update(len(items))
+
+            for chunk in read_chunks(reader, questions_per_request):
+                if len(pending) >= max_in_flight:
+                    write_oldest()
+                pending.append(executor.submit(link_items, client, chunk, model, linker, question_fallback))
+            while pending:
+                write_oldest()
     except Exception as e:
         print("\n--- FATAL ERROR IN MAIN LOOP ---")
-        print(f"An unexpected error occurred while processing the item: {item}")
+        print(f"An unexpected error occurred after {total_questions} questions.")
         print("Full Traceback:")
         traceback.print_exc()
         print("--------------------------------")
         return
 
     print("\n--- Linking Complete ---")
-    print(f"Successfully linked {successful_links} out of {total_questions} questions.")
+    print(f"Successfully linked {successful_links} out of {total_questions} questions ({llm_questions} needed the LLM).")
     print(f"New linked data file saved to: {output_path}")
 
 if __name__ == "__main__":
@@ -117,6 +265,17 @@ if __name__ == "__main__":
     parser.add_argument("--entity_name_file", type=str, 
                         default="/shared/data3/hansont2/GRbench/processed/amazon/entity_id_to_name.json", 
                         help="Path to the entity_id_to_name.json file from preprocessing.")
+    parser.add_argument("--maps_dir", type=str, 
+                        default="/shared/data3/hansont2/GRbench/processed/amazon/maps", 
+                        help="Directory of the binary entity maps; --entity_name_file is used if it does not exist.")
+    parser.add_argument("--name_index_dir", type=str, 
+                        default="/shared/data3/hansont2/GRbench/processed/amazon/name_index", 
+                        help="Directory of the entity name index written by preprocess_grbench.py; built in memory if it does not exist.")
+    parser.add_argument("--min_fuzzy_score", type=float, default=0.5,
+                        help="Minimum fuzzy-match score for resolving an LLM-extracted name that is not an exact entity name.")
+    parser.add_argument("--question_fallback", action="store_true",
+                        help="Also match the whole question against entity names when the LLM-extracted name (or null) does not resolve. "
+                             "Without it, this fallback is only used for questions whose LLM request failed.")
     parser.add_argument("--output_file", type=str, 
                         default="/shared/data3/hansont2/GRbench/QA/amazon/data_linked_api.jsonl", 
                         help="Path to save the new, API-linked QA data file.")
@@ -124,6 +283,16 @@ if __name__ == "__main__":
                         help="Your OpenAI API key. Defaults to the OPENAI_API_KEY environment variable.")
     parser.add_argument("--model", type=str, default="gpt-3.5-turbo",
                         help="The OpenAI model to use for extraction (e.g., gpt-4o-mini, gpt-3.5-turbo-0125).")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of linking requests in flight.")
+    parser.add_argument("--questions_per_request", type=int, default=1,
+                        help="Number of questions packed into one JSON-mode request.")
+    parser.add_argument("--requests_per_minute", type=int, default=None,
+                        help="Request rate limit (unlimited by default).")
+    parser.add_argument("--tokens_per_minute", type=int, default=None,
+                        help="Token rate limit (unlimited by default).")
+    parser.add_argument("--max_retries", type=int, default=5,
+                        help="Attempts per request, with exponential backoff and jitter.")
     
     args = parser.parse_args()
     
@@ -131,9 +300,17 @@ if __name__ == "__main__":
     if not api_key:
         raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable or pass it with --api_key.")
     
-    client = OpenAI(api_key=api_key)
+    configure_llm_client(
+        max_concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        max_retries=args.max_retries,
+    )
+    client = get_llm_client(api_key)
     
     start_time = time.time()
-    link_qa_data_with_api(args.qa_file, args.entity_name_file, args.output_file, args.model, client)
+    link_qa_data_with_api(args.qa_file, args.entity_name_file, args.output_file, args.model, client, args.maps_dir,
+                          args.questions_per_request, args.concurrency, args.name_index_dir, args.min_fuzzy_score,
+                          args.question_fallback)
     end_time = time.time()
     print(f"Total execution time: {end_time - start_time:.2f} seconds.")
\ No newline at end of file
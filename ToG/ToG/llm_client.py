@@ -0,0 +1,146 @@
+import asyncio
+import random
+import threading
+import time
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, RateLimitError
+
+SYSTEM_PROMPT = "You are an AI assistant that helps people find information."
+ERROR_RESPONSE = "Error: Could not get a response from the language model."
+
+# Defaults for clients created by get_llm_client(); the main scripts override them with configure_llm_client().
+_CLIENT_CONFIG = {
+    "max_concurrency": 8,
+    "requests_per_minute": None,
+    "tokens_per_minute": None,
+    "max_retries": 5,
+    "base_url": None,
+}
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+class AsyncTokenBucket:
+    """Token bucket refilled continuously at rate_per_minute, holding at most one minute of tokens."""
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so tokens are handed out in FIFO order.
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, connection failures and server errors may succeed on retry; other API errors cannot."""
+    if isinstance(error, (RateLimitError, APIConnectionError)):  # APITimeoutError is an APIConnectionError
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code == 408 or error.status_code >= 500)
+
+
+class AsyncLLMClient:
+    """
+    Chat-completion client sharing one HTTP connection pool, with a concurrency limit, request/token
+    rate limits and exponential backoff with full jitter. Must be created inside the event loop that uses it.
+    """
+    def __init__(self, api_key, max_concurrency=8, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=5, base_delay=1.0, max_delay=60.0, base_url=None):
+        # Retries are handled here (with jitter and rate limiting), not by the SDK.
+        self.client = AsyncOpenAI(api_key=api_key or None, base_url=base_url, max_retries=0)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = AsyncTokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = AsyncTokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def chat(self, prompt, temperature, max_tokens, model="gpt-3.5-turbo", response_format=None):
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+        # Only sent when set, so plain requests stay identical to before.
+        extra_args = {"response_format": response_format} if response_format else {}
+        # Rough token estimate (~4 characters per token) for the tokens-per-minute budget.
+        estimated_tokens = len(SYSTEM_PROMPT + prompt) // 4 + max_tokens
+        for attempt in range(self.max_retries):
+            if self.request_bucket:
+                await self.request_bucket.acquire(1)
+            if self.token_bucket:
+                await self.token_bucket.acquire(estimated_tokens)
+            try:
+                async with self.semaphore:
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        frequency_penalty=0,
+                        presence_penalty=0,
+                        **extra_args,
+                    )
+                return response.choices[0].message.content
+            except Exception as e:
+                if not is_retryable(e):
+                    print(f"OpenAI API error: {e}. Not retrying.")
+                    return ERROR_RESPONSE
+                if attempt == self.max_retries - 1:
+                    print(f"OpenAI API error: {e}.")
+                    break
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"OpenAI API error: {e}. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+        print("All OpenAI API retries failed.")
+        return ERROR_RESPONSE
+
+
+class SyncLLMClient:
+    """
+    Blocking shim over AsyncLLMClient. The async client runs on a private event loop thread, so any
+    number of caller threads can issue requests concurrently through one connection pool and one set of limits.
+    """
+    def __init__(self, api_key, **client_kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self._run(self._create_client(api_key, client_kwargs))
+
+    async def _create_client(self, api_key, client_kwargs):
+        return AsyncLLMClient(api_key, **client_kwargs)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def chat(self, prompt, temperature, max_tokens, model="gpt-3.5-turbo", response_format=None):
+        return self._run(self.client.chat(prompt, temperature, max_tokens, model, response_format))
+
+    def chat_many(self, prompts, temperature, max_tokens, model="gpt-3.5-turbo"):
+        """Issues all prompts concurrently and returns the responses in prompt order."""
+        async def gather():
+            return await asyncio.gather(*[self.client.chat(prompt, temperature, max_tokens, model) for prompt in prompts])
+        return self._run(gather())
+
+
+def configure_llm_client(**config):
+    """Sets max_concurrency, requests_per_minute, tokens_per_minute, max_retries or base_url for new clients."""
+    unknown = set(config) - set(_CLIENT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown LLM client options: {sorted(unknown)}")
+    _CLIENT_CONFIG.update(config)
+
+
+def get_llm_client(api_key):
+    """Returns the process-wide client for api_key, creating it on first use."""
+    with _CLIENTS_LOCK:
+        if api_key not in _CLIENTS:
+            _CLIENTS[api_key] = SyncLLMClient(api_key, **_CLIENT_CONFIG)
+        return _CLIENTS[api_key]
@@ -30,12 +30,25 @@ if __name__ == '__main__':
                         default=5, help="Number of entities retained during entities search.")
     parser.add_argument("--prune_tools", type=str,
                         default="llm", help="prune tools for ToG, can be llm (same as LLM_type), bm25 or sentencebert.")
+    add_llm_client_args(parser)
+    add_output_args(parser)
+    add_prune_tool_args(parser)
+    add_sparql_args(parser)
     args = parser.parse_args()
+    configure_llm_from_args(args)
+    configure_output_from_args(args)
+    configure_sparql_from_args(args)
+    configure_prune_tools_from_args(args)
 
     datas, question_string = prepare_dataset(args.dataset)
     print("Start Running ToG on %s dataset." % args.dataset)
+    completed = load_completed_questions(args.dataset) if args.resume else set()
+    if completed:
+        print("Resuming: skipping %d questions already answered." % len(completed))
     for data in tqdm(datas):
         question = data[question_string]
+        if question in completed:
+            continue
         topic_entity = data['topic_entity']
         cluster_chain_of_entities = []
         if len(topic_entity) == 0:
@@ -46,13 +59,12 @@ if __name__ == '__main__':
         pre_heads= [-1] * len(topic_entity)
         flag_printed = False
         for depth in range(1, args.depth+1):
+            # Relations of the whole frontier come from one batched query; the relation-prune calls are independent, so they run concurrently.
+            frontier_relations = entity_relations_batch([entity for entity in topic_entity if entity!="[FINISH_ID]"])
+            prune_jobs = [(entity, topic_entity[entity], pre_relations, pre_heads[i], question, args, frontier_relations[entity]) for i, entity in enumerate(topic_entity) if entity!="[FINISH_ID]"]
             current_entity_relations_list = []
-            i=0
-            for entity in topic_entity:
-                if entity!="[FINISH_ID]":
-                    retrieve_relations_with_scores = relation_search_prune(entity, topic_entity[entity], pre_relations, pre_heads[i], question, args)  # best entity triplet, entitiy_id
-                    current_entity_relations_list.extend(retrieve_relations_with_scores)
-                i+=1
+            for retrieve_relations_with_scores in run_in_parallel(relation_search_prune, prune_jobs):  # best entity triplet, entitiy_id
+                current_entity_relations_list.extend(retrieve_relations_with_scores)
             total_candidates = []
             total_scores = []
             total_relations = []
@@ -60,20 +72,23 @@ if __name__ == '__main__':
             total_topic_entities = []
             total_head = []
 
-            for entity in current_entity_relations_list:
-                if entity['head']:
-                    entity_candidates_id = entity_search(entity['entity'], entity['relation'], True)
-                else:
-                    entity_candidates_id = entity_search(entity['entity'], entity['relation'], False)
-                
+            # Entity searches of all pruned relations are batched into VALUES queries, sampling stays sequential,
+            # the candidates' names are fetched in one batch, then all scoring calls run concurrently.
+            search_results = entity_search_batch([(entity['entity'], entity['relation'], bool(entity['head'])) for entity in current_entity_relations_list])
+            score_jobs = []
+            scored_entities = []
+            for entity, entity_candidates_id in zip(current_entity_relations_list, search_results):
                 if args.prune_tools == "llm":
                     if len(entity_candidates_id) >=20:
                         entity_candidates_id = random.sample(entity_candidates_id, args.num_retain_entity)
 
                 if len(entity_candidates_id) ==0:
                     continue
-                scores, entity_candidates, entity_candidates_id = entity_score(question, entity_candidates_id, entity['score'], entity['relation'], args)
-                
+                score_jobs.append((question, entity_candidates_id, entity['score'], entity['relation'], args))
+                scored_entities.append(entity)
+
+            entity_names([entity_id for job in score_jobs for entity_id in job[1]])
+            for entity, (scores, entity_candidates, entity_candidates_id) in zip(scored_entities, run_in_parallel(entity_score, score_jobs)):
                 total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head = update_history(entity_candidates, entity, scores, entity_candidates_id, total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head)
             
             if len(total_candidates) ==0:
@@ -97,7 +112,8 @@ if __name__ == '__main__':
                         half_stop(question, cluster_chain_of_entities, depth, args)
                         flag_printed = True
                     else:
-                        topic_entity = {entity: id2entity_name_or_type(entity) for entity in entities_id}
+                        names = entity_names(entities_id)
+                        topic_entity = {entity: names[entity] for entity in entities_id}
                         continue
             else:
                 half_stop(question, cluster_chain_of_entities, depth, args)
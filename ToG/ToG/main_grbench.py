@@ -1,48 +1,181 @@
 import argparse
 import json
+import os
 import random
-import re
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from tqdm import tqdm
-import graph_tool.all as gt
 import jsonlines
 from grbench_func import *
+from grbench_index import load_adjacency, build_adjacency_from_graph, load_grbench_maps
+from name_index import load_name_index, extract_topic_entity_from_question, REGEX_MIN_SCORE
 from utils import *
 
-def load_grbench_data_for_ToG(graph_path, entity_name_path, relation_name_path, entity_vertex_path):
+def build_vertex2id_map(id2vertex_map, num_vertices):
+    """Dense reverse index: position i holds the entity id of vertex i (None if unmapped)."""
+    vertex2id_map = [None] * num_vertices
+    for entity_id, vertex_index in id2vertex_map.items():
+        vertex2id_map[vertex_index] = entity_id
+    return vertex2id_map
+
+def load_grbench_data_for_ToG(graph_path, entity_name_path, relation_name_path, entity_vertex_path, vertex_entity_path=None, maps_dir=None):
     print("Loading GRBench graph data for ToG...")
-    g = gt.load_graph(graph_path)
-    with open(entity_name_path, 'r', encoding='utf-8') as f:
-        id2entity_map = json.load(f)
-    with open(relation_name_path, 'r', encoding='utf-8') as f:
-        id2relation_map = json.load(f)
-        relation2id_map = {name: int(id) for id, name in id2relation_map.items()}
-    with open(entity_vertex_path, 'r', encoding='utf-8') as f:
-        id2vertex_map = json.load(f)
-    print(f"Graph loaded: {g.num_vertices()} vertices, {g.num_edges()} edges.")
-    return g, id2entity_map, id2relation_map, relation2id_map, id2vertex_map
-
-# --- FINAL, MORE ROBUST EXTRACTION FUNCTION ---
-def extract_topic_entity_from_question(question):
+    adjacency = load_adjacency(os.path.dirname(graph_path))
+    if adjacency is None:
+        import graph_tool.all as gt
+        print("CSR adjacency not found next to graph.gt, building it in memory...")
+        adjacency = build_adjacency_from_graph(gt.load_graph(graph_path))
+
+    maps = load_grbench_maps(maps_dir) if maps_dir else None
+    if maps is not None:
+        # Memory-mapped string tables: near-instant startup, pages shared across processes.
+        id2entity_map, id2relation_map, id2vertex_map, vertex2id_map, name2id_map = maps
+    else:
+        print("Binary maps not found, falling back to the JSON maps...")
+        with open(entity_name_path, 'r', encoding='utf-8') as f:
+            id2entity_map = json.load(f)
+        with open(relation_name_path, 'r', encoding='utf-8') as f:
+            id2relation_map = json.load(f)
+        with open(entity_vertex_path, 'r', encoding='utf-8') as f:
+            id2vertex_map = json.load(f)
+        if vertex_entity_path and os.path.exists(vertex_entity_path):
+            with open(vertex_entity_path, 'r', encoding='utf-8') as f:
+                vertex2id_map = json.load(f)
+        else:
+            print("Reverse vertex map not found, building it from the entity-to-vertex map...")
+            vertex2id_map = build_vertex2id_map(id2vertex_map, adjacency.num_vertices)
+        name2id_map = {name: id for id, name in id2entity_map.items()}
+    relation2id_map = {name: int(id) for id, name in id2relation_map.items()}
+    print(f"Graph loaded: {adjacency.num_vertices} vertices, {adjacency.num_edges} edges.")
+    return adjacency, id2entity_map, id2relation_map, relation2id_map, id2vertex_map, vertex2id_map, name2id_map
+
+def tog_search(data, args, adjacency, id2entity, id2relation, relation2id, id2vertex, vertex2id, checkpoint=None, name_index=None):
     """
-    Uses a series of regular expressions to find the topic entity in various question formats.
+    Runs the ToG search for one QA item and returns (question, results, cluster_chain_of_entities, link_source),
+    or None if the question has no linked topic entity. Only reads the shared graph data, so it is
+    safe to call from several threads. With a checkpoint, the state after each depth is recorded
+    and a previously checkpointed search continues from its last completed depth. Questions without
+    a pre-linked entity are linked locally through name_index when one is given: by their regex-extracted
+    name, and with args.question_fallback by the entity name best covered by the whole question.
+    link_source says which one linked the question (for pre-linked questions, the one recorded by link_qa.py).
     """
-    # Define a list of patterns from most specific to most general
-    patterns = [
-        # For questions like: "...item 'ENTITY_NAME'?"
-        r"item '(.*?)'",
-        # For questions like: "...brand of ENTITY_NAME?" or "...item ENTITY_NAME have..."
-        r"(?:brand of|item|with|query:)\s+((?:[\w\s'-:]+(?:\s\(.+?\))?)+?)(?:\?|\s+have|\s+cost|\s+fall|\s+classified)",
-        # For recommendation questions: "based on his history: ["ENTITY_NAME", ...]"
-        r'history:\s*\[\s*"(.*?)"'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, question, re.IGNORECASE)
+    question = data['question']
+
+    # Directly use the pre-linked entity from our previous script
+    topic_entity = {}
+    link_source = None
+    if 'topic_entity_id' in data and 'topic_entity_name' in data:
+        topic_entity_id = data['topic_entity_id']
+        topic_entity_name = data['topic_entity_name']
+        topic_entity = {topic_entity_id: topic_entity_name}
+        link_source = data.get('link_source')
+
+    if not topic_entity and name_index is not None:
+        match, link_source = name_index.lookup(extract_topic_entity_from_question(question), REGEX_MIN_SCORE), "regex"
+        if not match and args.question_fallback:
+            match, link_source = name_index.find_in_text(question), "question_fallback"
         if match:
-            # Return the first captured group, stripped of whitespace
-            return match.group(1).strip()
+            topic_entity = {match[0]: id2entity_name_or_type(match[0], id2entity)}
+    
+    if not topic_entity:
+        # This will now only skip questions that neither the GPT API nor the name index could link
+        print(f"Warning: No pre-linked topic entity found for question: '{question}'. Skipping.")
+        # Optionally, you can still generate a direct answer
+        # results = generate_without_explored_paths(question, args)
+        # return question, results, []
+        return None
+
+    cluster_chain_of_entities = []
+    pre_relations = []
+    pre_heads = [-1] * len(topic_entity)
+    start_depth = 1
+    state = checkpoint.get(question) if checkpoint else None
+    if state:
+        start_depth = state['depth']
+        topic_entity = state['topic_entity']
+        cluster_chain_of_entities = state['cluster_chain_of_entities']
+        pre_relations = state['pre_relations']
+        pre_heads = state['pre_heads']
+
+    # Main ToG loop
+    for depth in range(start_depth, args.depth + 1):
+        # All relation-prune calls of the current frontier are independent, so they run concurrently.
+        prune_jobs = [
+            (entity_id, entity_name, pre_relations, pre_heads[i], question, args, adjacency, id2relation, id2vertex)
+            for i, (entity_id, entity_name) in enumerate(topic_entity.items()) if entity_id != "[FINISH_ID]"
+        ]
+        current_entity_relations_list = []
+        for relations_with_scores in run_in_parallel(relation_search_prune, prune_jobs):
+            current_entity_relations_list.extend(relations_with_scores)
+        
+        if not current_entity_relations_list:
+            return question, half_stop(question, cluster_chain_of_entities, depth, args), cluster_chain_of_entities, link_source
+
+        total_candidates, total_scores, total_relations = [], [], []
+        total_entities_id, total_topic_entities, total_head = [], [], []
+
+        # Candidate search and sampling stay sequential (cheap, and keeps random.sample deterministic);
+        # the entity-score calls are then dispatched together and merged back in order.
+        score_jobs, scored_relations = [], []
+        for entity_relation in current_entity_relations_list:
+            entity_candidates_id = entity_search(
+                entity_relation['entity'], entity_relation['relation'], entity_relation['head'], 
+                adjacency, relation2id, id2vertex, vertex2id
+            )
             
-    return None
+            if not entity_candidates_id: continue
+            if args.prune_tools == "llm" and len(entity_candidates_id) > 20:
+                entity_candidates_id = random.sample(entity_candidates_id, args.num_retain_entity)
+
+            score_jobs.append((question, entity_candidates_id, entity_relation['score'], entity_relation['relation'], args, id2entity))
+            scored_relations.append(entity_relation)
+
+        for entity_relation, (scores, entity_candidates_names, entity_candidates_id) in zip(scored_relations, run_in_parallel(entity_score, score_jobs)):
+            total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head = update_history(
+                entity_candidates_names, entity_relation, scores, entity_candidates_id, total_candidates, total_scores, 
+                total_relations, total_entities_id, total_topic_entities, total_head
+            )
+        
+        if not total_candidates:
+            return question, half_stop(question, cluster_chain_of_entities, depth, args), cluster_chain_of_entities, link_source
+            
+        flag, chain, entities_id, pre_relations, pre_heads = entity_prune(
+            total_entities_id, total_relations, total_candidates, total_topic_entities, 
+            total_head, total_scores, args, id2entity
+        )
+        
+        if not flag:
+            return question, half_stop(question, cluster_chain_of_entities, depth, args), cluster_chain_of_entities, link_source
+
+        cluster_chain_of_entities.append(chain)
+        
+        stop, results = reasoning(question, cluster_chain_of_entities, args)
+        if stop:
+            return question, results, cluster_chain_of_entities, link_source
+        else:
+            flag_finish, entities_id = if_finish_list(entities_id)
+            if flag_finish:
+                return question, half_stop(question, cluster_chain_of_entities, depth, args), cluster_chain_of_entities, link_source
+            else:
+                topic_entity = {eid: id2entity_name_or_type(eid, id2entity) for eid in entities_id}
+                if checkpoint:
+                    checkpoint.update(question, {
+                        'depth': depth + 1, 'topic_entity': topic_entity, 'cluster_chain_of_entities': list(cluster_chain_of_entities),
+                        'pre_relations': list(pre_relations), 'pre_heads': list(pre_heads),
+                    })
+    
+    results = generate_answer(question, cluster_chain_of_entities, args)
+    return question, results, cluster_chain_of_entities, link_source
+
+def run_safely(search, data):
+    # A failing question must not abort the other in-flight questions of a concurrent run.
+    try:
+        return search(data)
+    except Exception:
+        print(f"Error while processing question: '{data.get('question')}'")
+        traceback.print_exc()
+        return None
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run ToG method on GRBench dataset.")
@@ -63,114 +196,58 @@ if __name__ == '__main__':
     parser.add_argument("--relation_name_path", default="/shared/data3/hansont2/GRbench/processed/amazon/relation_id_to_name.json",  help="Path to relation_id_to_name.json file.")
     # *** NEW: Argument for the new map ***
     parser.add_argument("--entity_vertex_path", default="/shared/data3/hansont2/GRbench/processed/amazon/entity_id_to_vertex_index.json",  help="Path to entity_id_to_vertex_index.json file.")
+    parser.add_argument("--vertex_entity_path", default="/shared/data3/hansont2/GRbench/processed/amazon/vertex_index_to_entity_id.json",  help="Path to vertex_index_to_entity_id.json file (rebuilt in memory if missing).")
+    parser.add_argument("--maps_dir", default="/shared/data3/hansont2/GRbench/processed/amazon/maps",  help="Directory of the binary entity/relation maps; the JSON maps are used if it does not exist.")
+    parser.add_argument("--name_index_dir", default="/shared/data3/hansont2/GRbench/processed/amazon/name_index",  help="Directory of the entity name index, used to link questions the QA file has no topic entity for.")
+    parser.add_argument("--question_fallback", action="store_true", help="Link questions whose regex-extracted name does not resolve by the entity name best covered by the whole question.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of questions searched concurrently.")
     parser.add_argument("--qa_file_path", default="/shared/data3/hansont2/GRbench/QA/amazon/data_linked_api.jsonl",  help="Path to QA data JSON file.")
+    add_llm_client_args(parser)
+    add_output_args(parser)
+    add_prune_tool_args(parser)
     args = parser.parse_args()
+    configure_llm_from_args(args)
+    configure_output_from_args(args)
 
     # Load all data
-    g, id2entity, id2relation, relation2id, id2vertex = load_grbench_data_for_ToG(
-        args.graph_path, args.entity_name_path, args.relation_name_path, args.entity_vertex_path
+    adjacency, id2entity, id2relation, relation2id, id2vertex, vertex2id, name2id = load_grbench_data_for_ToG(
+        args.graph_path, args.entity_name_path, args.relation_name_path, args.entity_vertex_path, args.vertex_entity_path, args.maps_dir
     )
 
+    # The GRBench relation vocabulary is small and fixed, so the local prune tools index it once up front.
+    configure_prune_tools_from_args(args, list(id2relation.values()))
+    name_index = load_name_index(args.name_index_dir) if args.name_index_dir else None
+
     with open(args.qa_file_path, 'r', encoding='utf-8') as f:
         datas = [item for item in jsonlines.Reader(f)]
 
-    print("Creating name-to-ID lookup map for topic entities...")
-    name2id = {name: id for id, name in id2entity.items()}
-    
-    for data in tqdm(datas):
-        question = data['question']
-        
-        # Directly use the pre-linked entity from our previous script
-        topic_entity = {}
-        if 'topic_entity_id' in data and 'topic_entity_name' in data:
-            topic_entity_id = data['topic_entity_id']
-            topic_entity_name = data['topic_entity_name']
-            topic_entity = {topic_entity_id: topic_entity_name}
-        
-        if not topic_entity:
-            # This will now only skip questions that the GPT API failed to link
-            print(f"Warning: No pre-linked topic entity found for question: '{question}'. Skipping.")
-            # Optionally, you can still generate a direct answer
-            # results = generate_without_explored_paths(question, args)
-            # save_2_jsonl(question, results, [], file_name=args.dataset)
-            continue
-
-        cluster_chain_of_entities = []
-        pre_relations = []
-        pre_heads = [-1] * len(topic_entity)
-        flag_printed = False
-        
-        # Main ToG loop
-        for depth in range(1, args.depth + 1):
-            current_entity_relations_list = []
-            i = 0
-            for entity_id, entity_name in topic_entity.items():
-                if entity_id != "[FINISH_ID]":
-                    relations_with_scores = relation_search_prune(
-                        entity_id, entity_name, pre_relations, pre_heads[i], question, args, 
-                        g, id2relation, id2vertex
-                    )
-                    current_entity_relations_list.extend(relations_with_scores)
-                i += 1
-            
-            if not current_entity_relations_list:
-                half_stop(question, cluster_chain_of_entities, depth, args)
-                flag_printed = True
-                break
-
-            total_candidates, total_scores, total_relations = [], [], []
-            total_entities_id, total_topic_entities, total_head = [], [], []
-
-            for entity_relation in current_entity_relations_list:
-                entity_candidates_id = entity_search(
-                    entity_relation['entity'], entity_relation['relation'], entity_relation['head'], 
-                    g, relation2id, id2vertex
-                )
-                
-                if not entity_candidates_id: continue
-                if args.prune_tools == "llm" and len(entity_candidates_id) > 20:
-                    entity_candidates_id = random.sample(entity_candidates_id, args.num_retain_entity)
-
-                scores, entity_candidates_names, entity_candidates_id = entity_score(
-                    question, entity_candidates_id, entity_relation['score'], entity_relation['relation'], args, id2entity
-                )
-                
-                total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head = update_history(
-                    entity_candidates_names, entity_relation, scores, entity_candidates_id, total_candidates, total_scores, 
-                    total_relations, total_entities_id, total_topic_entities, total_head
-                )
-            
-            if not total_candidates:
-                half_stop(question, cluster_chain_of_entities, depth, args)
-                flag_printed = True
-                break
-                
-            flag, chain, entities_id, pre_relations, pre_heads = entity_prune(
-                total_entities_id, total_relations, total_candidates, total_topic_entities, 
-                total_head, total_scores, args, id2entity
-            )
-            
-            if not flag:
-                half_stop(question, cluster_chain_of_entities, depth, args)
-                flag_printed = True
-                break
+    if args.resume:
+        completed = load_completed_questions(args.dataset)
+        datas = [data for data in datas if data['question'] not in completed]
+        print(f"Resuming: {len(completed)} questions already answered, {len(datas)} left.")
+    # Searches are checkpointed after every depth; the state of a question is dropped once its answer is written.
+    checkpoint = SearchCheckpoint(os.path.join(args.output_dir, f"ToG_{args.dataset}.checkpoint.json"), args.checkpoint_interval, load=args.resume)
 
-            cluster_chain_of_entities.append(chain)
-            
-            stop, results = reasoning(question, cluster_chain_of_entities, args)
-            if stop:
-                save_2_jsonl(question, results, cluster_chain_of_entities, file_name=args.dataset)
-                flag_printed = True
-                break
-            else:
-                flag_finish, entities_id = if_finish_list(entities_id)
-                if flag_finish:
-                    half_stop(question, cluster_chain_of_entities, depth, args)
-                    flag_printed = True
-                    break
-                else:
-                    topic_entity = {eid: id2entity_name_or_type(eid, id2entity) for eid in entities_id}
-        
-        if not flag_printed:
-            results = generate_answer(question, cluster_chain_of_entities, args)
-            save_2_jsonl(question, results, cluster_chain_of_entities, file_name=args.dataset)
\ No newline at end of file
+    def save_output(output):
+        if output:
+            question, results, cluster_chain_of_entities, link_source = output
+            # Rows record how their topic entity was linked, so whole-question fallback links can be told apart.
+            fields = {"link_source": link_source} if link_source else {}
+            save_2_jsonl(question, results, cluster_chain_of_entities, file_name=args.dataset, **fields)
+            checkpoint.discard(question)
+
+    search = partial(
+        tog_search, args=args, adjacency=adjacency, id2entity=id2entity, id2relation=id2relation,
+        relation2id=relation2id, id2vertex=id2vertex, vertex2id=vertex2id, checkpoint=checkpoint,
+        name_index=name_index
+    )
+    if args.concurrency > 1:
+        # executor.map yields results in input order, so the main thread writes lines in question order
+        # while later questions keep searching in the background.
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for output in tqdm(executor.map(partial(run_safely, search), datas), total=len(datas)):
+                save_output(output)
+    else:
+        for data in tqdm(datas):
+            save_output(search(data))
+    checkpoint.flush()
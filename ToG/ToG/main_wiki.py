@@ -32,12 +32,23 @@ if __name__ == '__main__':
                         default="llm", help="prune tools for ToG, can be llm (same as LLM_type), bm25 or sentencebert.")
     parser.add_argument("--addr_list", type=str,
                         default="server_urls.txt", help="The address of the Wikidata service.")
+    add_llm_client_args(parser)
+    add_output_args(parser)
+    add_prune_tool_args(parser)
     args = parser.parse_args()
+    configure_llm_from_args(args)
+    configure_output_from_args(args)
+    configure_prune_tools_from_args(args)
         
     datas, question_string = prepare_dataset(args.dataset)
     print("Start Running ToG on %s dataset." % args.dataset)
+    completed = load_completed_questions(args.dataset) if args.resume else set()
+    if completed:
+        print("Resuming: skipping %d questions already answered." % len(completed))
     for data in tqdm(datas):
         question = data[question_string]
+        if question in completed:
+            continue
         topic_entity = data['qid_topic_entity']
         cluster_chain_of_entities = []
         if len(topic_entity) == 0:
@@ -53,13 +64,13 @@ if __name__ == '__main__':
         print(f"Server addresses: {server_addrs}")
         wiki_client = MultiServerWikidataQueryClient(server_addrs)
         for depth in range(1, args.depth+1):
+            # Relations of the whole frontier come from one batched call per server; the relation-prune calls are independent, so they run concurrently.
+            frontier = [entity for entity in topic_entity if entity!="[FINISH_ID]"]
+            frontier_relations = dict(zip(frontier, wiki_client.get_all_relations_batch(frontier)))
+            prune_jobs = [(entity, topic_entity[entity], pre_relations, pre_heads[i], question, args, wiki_client, frontier_relations[entity]) for i, entity in enumerate(topic_entity) if entity!="[FINISH_ID]"]
             current_entity_relations_list = []
-            i=0
-            for entity in topic_entity:
-                if entity!="[FINISH_ID]":
-                    retrieve_relations_with_scores = relation_search_prune(entity, topic_entity[entity], pre_relations, pre_heads[i], question, args, wiki_client)  # best entity triplet, entitiy_id
-                    current_entity_relations_list.extend(retrieve_relations_with_scores)
-                i+=1
+            for retrieve_relations_with_scores in run_in_parallel(relation_search_prune, prune_jobs):  # best entity triplet, entitiy_id
+                current_entity_relations_list.extend(retrieve_relations_with_scores)
             total_candidates = []
             total_scores = []
             total_relations = []
@@ -67,12 +78,12 @@ if __name__ == '__main__':
             total_topic_entities = []
             total_head = []
 
-            for entity in current_entity_relations_list:
+            # Wikidata entity searches are batched per server, sampling stays sequential, then all scoring calls run concurrently.
+            search_results = entity_search_batch([(entity['entity'], entity['relation'], bool(entity['head'])) for entity in current_entity_relations_list], wiki_client)
+            score_jobs = []
+            scored_entities = []
+            for entity, (entity_candidates_id, entity_candidates_name) in zip(current_entity_relations_list, search_results):
                 value_flag=False
-                if entity['head']:
-                    entity_candidates_id, entity_candidates_name = entity_search(entity['entity'], entity['relation'], wiki_client, True)
-                else:
-                    entity_candidates_id, entity_candidates_name = entity_search(entity['entity'], entity['relation'], wiki_client, False)
                 if len(entity_candidates_name)==0:
                     continue
                 if len(entity_candidates_id) ==0: # values
@@ -90,8 +101,10 @@ if __name__ == '__main__':
                 if len(entity_candidates_id) ==0:
                     continue
 
-                scores, entity_candidates, entity_candidates_id = entity_score(question, entity_candidates_id, entity_candidates_name, entity['score'], entity['relation'], args)
-                
+                score_jobs.append((question, entity_candidates_id, entity_candidates_name, entity['score'], entity['relation'], args))
+                scored_entities.append((entity, value_flag))
+
+            for (entity, value_flag), (scores, entity_candidates, entity_candidates_id) in zip(scored_entities, run_in_parallel(entity_score, score_jobs)):
                 total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head = update_history(entity_candidates, entity, scores, entity_candidates_id, total_candidates, total_scores, total_relations, total_entities_id, total_topic_entities, total_head, value_flag)
             
             if len(total_candidates) ==0:
@@ -115,7 +128,7 @@ if __name__ == '__main__':
                         half_stop(question, cluster_chain_of_entities, depth, args)
                         flag_printed = True
                     else:
-                        topic_entity = {qid: topic for qid, topic in zip(entities_id, [wiki_client.query_all("qid2label", entity).pop() for entity in entities_id])}
+                        topic_entity = {qid: topic for qid, topic in zip(entities_id, wiki_client.qid2label_batch(entities_id))}
                         continue
             else:
                 half_stop(question, cluster_chain_of_entities, depth, args)
@@ -0,0 +1,229 @@
+import math
+import os
+import re
+import unicodedata
+from array import array
+from collections.abc import Mapping
+import numpy as np
+from grbench_index import save_string_table, load_string_table
+
+NAME_INDEX_DIR_NAME = "name_index"
+# Candidate entities are gathered from the rarest query tokens until this many postings were read.
+MAX_CANDIDATE_POSTINGS = 4096
+# Tokens in more names than this ("the", "black", ...) are never used to generate candidates; they still
+# count when the candidates are rescored. A query made only of such tokens has no fuzzy candidates.
+MAX_TOKEN_POSTINGS = 2048
+# Number of best partial matches rescored exactly with the forward (entity -> tokens) index.
+NUM_RESCORED = 256
+# Regex-extracted names are only trusted (and the LLM skipped) when they match an entity this closely.
+REGEX_MIN_SCORE = 0.9
+
+_NON_ALNUM = re.compile(r"[^\w]+")
+
+
+def normalize_name(name):
+    """Case-folded, NFKC-normalized name with punctuation replaced by single spaces."""
+    name = unicodedata.normalize("NFKC", name).casefold()
+    return " ".join(_NON_ALNUM.sub(" ", name).replace("_", " ").split())
+
+
+def extract_topic_entity_from_question(question):
+    """
+    Uses a series of regular expressions to find the topic entity in various question formats.
+    The result is a surface form; resolve it with EntityNameIndex.lookup.
+    """
+    # Define a list of patterns from most specific to most general
+    patterns = [
+        # For questions like: "...item 'ENTITY_NAME'?"
+        r"item '(.*?)'",
+        # For questions like: "...brand of ENTITY_NAME?" or "...item ENTITY_NAME have..."
+        r"(?:brand of|item|with|query:)\s+((?:[\w\s'-:]+(?:\s\(.+?\))?)+?)(?:\?|\s+have|\s+cost|\s+fall|\s+classified)",
+        # For recommendation questions: "based on his history: ["ENTITY_NAME", ...]"
+        r'history:\s*\[\s*"(.*?)"'
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, question, re.IGNORECASE)
+        if match:
+            # Return the first captured group, stripped of whitespace
+            return match.group(1).strip()
+
+    return None
+
+
+class _TablePositions(Mapping):
+    """string -> position of its first occurrence, backed by a sorted StringTable."""
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, key):
+        position = self.table.find(key)
+        if position is None:
+            raise KeyError(key)
+        return position
+
+    def __iter__(self):
+        return iter(dict.fromkeys(self.table))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class EntityNameIndex:
+    """
+    Offline entity-name index: exact lookup of normalized names plus an IDF-weighted inverted index over
+    name tokens for fuzzy matching. Entities are referred to by position (the vertex index for GRBench maps).
+    """
+    def __init__(self, entity_ids, exact, vocab, postings_offsets, postings, token_offsets, tokens, idf, name_norms):
+        self.entity_ids = entity_ids
+        self.exact = exact
+        self.vocab = vocab
+        self.postings_offsets = postings_offsets
+        self.postings = postings
+        self.token_offsets = token_offsets
+        self.tokens = tokens
+        self.idf = idf
+        self.name_norms = name_norms
+        # Weight of a query token that no entity name contains.
+        self.unknown_idf = math.log(1 + len(name_norms)) if len(name_norms) else 0.0
+
+    def __len__(self):
+        return len(self.name_norms)
+
+    def _query(self, text):
+        """Returns (known token ids, rarest first; total query weight)."""
+        token_ids, weight = set(), 0.0
+        for token in set(normalize_name(text).split()):
+            token_id = self.vocab.get(token)
+            if token_id is None:
+                weight += self.unknown_idf
+            else:
+                token_ids.add(int(token_id))
+                weight += float(self.idf[token_id])
+        return sorted(token_ids, key=lambda t: self.postings_offsets[t + 1] - self.postings_offsets[t]), weight
+
+    def _candidate_tokens(self, token_ids):
+        """The rarest query tokens whose postings are read to generate candidates."""
+        chosen, read = [], 0
+        for token_id in token_ids:
+            size = int(self.postings_offsets[token_id + 1] - self.postings_offsets[token_id])
+            if size > MAX_TOKEN_POSTINGS or read + size > MAX_CANDIDATE_POSTINGS:
+                break
+            chosen.append(token_id)
+            read += size
+        return chosen
+
+    def _matches(self, token_ids):
+        """Returns [(position, matched query weight)] for the best candidates sharing tokens with the query."""
+        chosen = self._candidate_tokens(token_ids)
+        if not chosen:
+            return []
+        lists = [self.postings[self.postings_offsets[t]:self.postings_offsets[t + 1]] for t in chosen]
+        weights = np.repeat(self.idf[chosen], [len(l) for l in lists])
+        candidates, inverse = np.unique(np.concatenate(lists), return_inverse=True)
+        partial = np.bincount(inverse, weights=weights)
+        if len(candidates) > NUM_RESCORED:
+            best = np.argpartition(-partial, NUM_RESCORED)[:NUM_RESCORED]
+            candidates = candidates[best]
+
+        # Exact matched weight, including the common tokens left out of candidate generation.
+        starts, ends = self.token_offsets[candidates], self.token_offsets[candidates + 1]
+        lengths = ends - starts
+        owner = np.repeat(np.arange(len(candidates)), lengths)
+        name_tokens = self.tokens[np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+        in_query = np.isin(name_tokens, token_ids)
+        matched = np.bincount(owner[in_query], weights=self.idf[name_tokens[in_query]], minlength=len(candidates))
+        return list(zip(candidates.tolist(), matched.tolist()))
+
+    def lookup(self, name, min_score=0.5):
+        """
+        Resolves an entity name to (entity_id, score), or None. An exact normalized match scores 1.0;
+        otherwise the score is the product of the query and name coverage by shared token weight.
+        """
+        if not name:
+            return None
+        position = self.exact.get(normalize_name(name))
+        if position is not None:
+            return self.entity_ids[int(position)], 1.0
+        token_ids, query_weight = self._query(name)
+        best = None
+        for position, matched in self._matches(token_ids):
+            score = matched * matched / (query_weight * float(self.name_norms[position]))
+            if score >= min_score and (best is None or score > best[1]):
+                best = (position, score)
+        return (self.entity_ids[best[0]], best[1]) if best else None
+
+    def find_in_text(self, text, min_coverage=0.9):
+        """
+        Finds the entity whose name is (almost) entirely contained in free text such as a whole question.
+        Among names covered to at least min_coverage, the one with the largest matched weight wins.
+        Returns (entity_id, coverage) or None.
+        """
+        token_ids, _ = self._query(text)
+        best = None
+        for position, matched in self._matches(token_ids):
+            coverage = matched / float(self.name_norms[position])
+            if coverage >= min_coverage and (best is None or matched > best[1]):
+                best = (position, matched, coverage)
+        return (self.entity_ids[best[0]], best[2]) if best else None
+
+
+def _build_arrays(entity_names):
+    vocab = {}
+    normalized = []
+    token_offsets = array('q', [0])
+    tokens = array('i')
+    for name in entity_names:
+        name = normalize_name(name)
+        normalized.append(name)
+        tokens.extend(sorted({vocab.setdefault(token, len(vocab)) for token in name.split()}))
+        token_offsets.append(len(tokens))
+    token_offsets = np.frombuffer(token_offsets, dtype=np.int64)
+    tokens = np.frombuffer(tokens, dtype=np.int32)
+
+    num_entities = len(normalized)
+    entity_of_token = np.repeat(np.arange(num_entities, dtype=np.int32), np.diff(token_offsets))
+    postings = entity_of_token[np.argsort(tokens, kind='stable')]
+    document_frequency = np.bincount(tokens, minlength=len(vocab))
+    postings_offsets = np.concatenate(([0], np.cumsum(document_frequency))).astype(np.int64)
+    idf = np.log1p(num_entities / np.maximum(document_frequency, 1)).astype(np.float32)
+    name_norms = np.bincount(entity_of_token, weights=idf[tokens], minlength=num_entities).astype(np.float32)
+    # Names without any token can never be fuzzy-matched; a norm of 1 keeps the score divisions finite.
+    name_norms[name_norms == 0] = 1.0
+    return normalized, vocab, postings_offsets, postings, token_offsets, tokens, idf, name_norms
+
+
+def build_name_index(entity_ids, entity_names):
+    """Builds an in-memory index. entity_ids and entity_names are aligned sequences."""
+    normalized, vocab, *arrays = _build_arrays(entity_names)
+    exact = {}
+    for position, name in enumerate(normalized):
+        exact.setdefault(name, position)
+    return EntityNameIndex(list(entity_ids), exact, vocab, *arrays)
+
+
+def save_name_index(entity_ids, entity_names, output_dir):
+    """Writes the index of aligned entity_ids/entity_names to output_dir/name_index for load_name_index."""
+    index_dir = os.path.join(output_dir, NAME_INDEX_DIR_NAME)
+    normalized, vocab, postings_offsets, postings, token_offsets, tokens, idf, name_norms = _build_arrays(entity_names)
+    save_string_table(list(entity_ids), index_dir, "entity_ids", sorted_index=False)
+    save_string_table(normalized, index_dir, "names")
+    save_string_table(list(vocab), index_dir, "vocab", sorted_index=False)
+    for name, values in (("postings_offsets", postings_offsets), ("postings", postings), ("token_offsets", token_offsets),
+                         ("tokens", tokens), ("idf", idf), ("name_norms", name_norms)):
+        np.save(os.path.join(index_dir, f"{name}.npy"), values)
+
+
+def load_name_index(index_dir, mmap_mode='r'):
+    """Memory-maps an index written by save_name_index. Returns None if it is missing."""
+    if not os.path.isdir(index_dir):
+        return None
+    arrays = [np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+              for name in ("postings_offsets", "postings", "token_offsets", "tokens", "idf", "name_norms")]
+    return EntityNameIndex(
+        load_string_table(index_dir, "entity_ids", mmap_mode),
+        _TablePositions(load_string_table(index_dir, "names", mmap_mode)),
+        # The token vocabulary is small next to the names and hit for every query token, so it is kept as a dict.
+        {token: token_id for token_id, token in enumerate(load_string_table(index_dir, "vocab", mmap_mode))},
+        *arrays,
+    )
@@ -1,48 +1,216 @@
+import gc
 import json
 import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+from array import array
 from tqdm import tqdm
 import graph_tool.all as gt
 import os
 import numpy as np
+from grbench_index import build_adjacency, save_adjacency, save_grbench_maps
+from name_index import save_name_index
 
 NODE_NAME_FEATURES = {
     'item': 'title', 'brand': 'name', 'paper': 'title',
     'author': 'name', 'venue': 'name',
 }
 
-def preprocess_graph_json(input_path, output_dir):
+def section_name_feature(node_type_key):
+    node_type = node_type_key.split('_nodes')[0]
+    return NODE_NAME_FEATURES.get(node_type, 'name')
+
+class StreamingGraphReader:
+    """
+    Incrementally parses a GRBench graph.json of the form {"<type>_nodes": {node_id: node_data, ...}, ...}.
+    Only one node's JSON is decoded at a time, so memory does not grow with the file size.
+    """
+    def __init__(self, path, read_size=1 << 20):
+        self.path = path
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+
+    def _open(self):
+        self.file = open(self.path, 'r', encoding='utf-8')
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_size=1):
+        # Drop the consumed prefix before reading more, so the buffer stays bounded.
+        if self.pos > self.read_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        while not self.eof and len(self.buffer) - self.pos < min_size:
+            chunk = self.file.read(max(self.read_size, min_size))
+            if not chunk:
+                self.eof = True
+            self.buffer += chunk
+
+    def _skip_ws(self):
+        while True:
+            self._fill()
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return
+
+    def _peek(self):
+        self._skip_ws()
+        if self.pos >= len(self.buffer):
+            raise ValueError(f"Unexpected end of file in {self.path}")
+        return self.buffer[self.pos]
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} in {self.path}, got '{self.buffer[self.pos]}'")
+        self.pos += 1
+
+    def _read_value(self):
+        # Objects and strings cannot be mis-parsed from a truncated buffer, so on a decode
+        # error we read further ahead and retry.
+        self._skip_ws()
+        lookahead = self.read_size
+        while True:
+            self._fill(lookahead)
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                lookahead *= 2
+                continue
+            self.pos = end
+            return value
+
+    def _end_of_member(self, closing):
+        # Consumes the separator after an object member; returns True when the object is closed.
+        char = self._peek()
+        self.pos += 1
+        if char == closing:
+            return True
+        if char != ',':
+            raise ValueError(f"Expected ',' or '{closing}' at offset {self.pos - 1} in {self.path}")
+        return False
+
+    def _iter_nodes(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            node_id = self._read_value()
+            self._expect(':')
+            node_data = self._read_value()
+            yield node_id, node_data
+            if self._end_of_member('}'):
+                return
+
+    def sections(self):
+        """Yields (node_type_key, iterator of (node_id, node_data)); each iterator must be consumed in order."""
+        self._open()
+        try:
+            self._expect('{')
+            if self._peek() == '}':
+                return
+            while True:
+                node_type_key = self._read_value()
+                self._expect(':')
+                nodes = self._iter_nodes()
+                yield node_type_key, nodes
+                for _ in nodes:
+                    pass
+                if self._end_of_member('}'):
+                    return
+        finally:
+            self.file.close()
+
+
+class EdgeChunkSpiller:
+    """Collects (source, target, relation) edges in fixed-size NumPy chunks spilled to a temporary directory."""
+    def __init__(self, spill_dir, chunk_size):
+        self.spill_dir = spill_dir
+        self.chunk_size = chunk_size
+        self.buffer = array('q')
+        self.chunk_paths = []
+        self.num_edges = 0
+
+    def append(self, source, target, relation):
+        self.buffer.extend((source, target, relation))
+        self.num_edges += 1
+        if len(self.buffer) >= 3 * self.chunk_size:
+            self._spill()
+
+    def _spill(self):
+        if not self.buffer:
+            return
+        path = os.path.join(self.spill_dir, f"edges_{len(self.chunk_paths):06d}.npy")
+        np.save(path, np.frombuffer(self.buffer, dtype=np.int64).reshape(-1, 3))
+        self.chunk_paths.append(path)
+        self.buffer = array('q')
+
+    def load(self):
+        self._spill()
+        if not self.chunk_paths:
+            return np.zeros((0, 3), dtype=np.int64)
+        return np.concatenate([np.load(path, mmap_mode='r') for path in self.chunk_paths])
+
+
+def load_sections_in_memory(input_path):
     print(f"Loading raw graph from: {input_path}...")
     with open(input_path, 'r', encoding='utf-8') as f:
         graph_data = json.load(f)
+    return lambda: ((node_type_key, graph_data[node_type_key].items()) for node_type_key in graph_data.keys())
+
+
+def report_throughput(stage, start_time, num_nodes, num_edges=None, num_bytes=None):
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    message = f"  - {stage}: {elapsed:.1f}s, {num_nodes / elapsed:,.0f} nodes/s"
+    if num_edges is not None:
+        message += f", {num_edges / elapsed:,.0f} edges/s"
+    if num_bytes is not None:
+        message += f", {num_bytes / elapsed / (1 << 20):,.1f} MB/s"
+    print(message)
+
+
+def preprocess_graph_json(input_path, output_dir, write_json=False, streaming=False, edge_chunk_size=1 << 22):
+    if streaming:
+        print(f"Streaming raw graph from: {input_path}...")
+        make_sections = StreamingGraphReader(input_path).sections
+        num_bytes = os.path.getsize(input_path)
+    else:
+        make_sections = load_sections_in_memory(input_path)
+        num_bytes = None
 
     print("Step 1: Creating mappings and graph structure...")
-    
+
     entity_id_to_name = {}
     relation_name_to_id = {}
     # *** NEW: This map is the key to the fix ***
     entity_id_to_vertex_index = {}
-    
-    g = gt.Graph(directed=True)
 
-    print("  - Pass 1: Adding vertices and building maps...")
-    for node_type_key in tqdm(graph_data.keys(), desc="Processing node types"):
-        node_type = node_type_key.split('_nodes')[0]
-        name_feature = NODE_NAME_FEATURES.get(node_type, 'name')
+    print("  - Pass 1: Assigning vertices and building maps...")
+    start_time = time.perf_counter()
+    for node_type_key, nodes in tqdm(make_sections(), desc="Processing node types"):
+        name_feature = section_name_feature(node_type_key)
 
-        for node_id, node_data in graph_data[node_type_key].items():
+        for node_id, node_data in nodes:
             if node_id not in entity_id_to_vertex_index:
-                v = g.add_vertex()
-                vertex_index = int(v)
-                entity_id_to_vertex_index[node_id] = vertex_index
+                entity_id_to_vertex_index[node_id] = len(entity_id_to_vertex_index)
                 entity_id_to_name[node_id] = node_data['features'].get(name_feature, "Unknown")
+    report_throughput("Pass 1", start_time, len(entity_id_to_vertex_index), num_bytes=num_bytes)
 
-    print("  - Pass 2: Collecting and adding edges...")
-    edge_list = []
-    relation_property_list = []
+    print("  - Pass 2: Collecting edges...")
+    os.makedirs(output_dir, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix="grbench_edges_", dir=output_dir)
+    spiller = EdgeChunkSpiller(spill_dir, edge_chunk_size)
     relation_id_counter = 0
+    start_time = time.perf_counter()
 
-    for node_type_key in tqdm(graph_data.keys(), desc="Collecting edges"):
-        for source_node_id, node_data in graph_data[node_type_key].items():
+    for node_type_key, nodes in tqdm(make_sections(), desc="Collecting edges"):
+        for source_node_id, node_data in nodes:
             source_vertex_index = entity_id_to_vertex_index[source_node_id]
             if 'neighbors' in node_data:
                 for relation_name, neighbor_ids in node_data['neighbors'].items():
@@ -53,39 +221,188 @@ def preprocess_graph_json(input_path, output_dir):
                     for target_node_id in neighbor_ids:
                         if target_node_id in entity_id_to_vertex_index:
                             target_vertex_index = entity_id_to_vertex_index[target_node_id]
-                            edge_list.append((source_vertex_index, target_vertex_index))
-                            relation_property_list.append(relation_id)
+                            spiller.append(source_vertex_index, target_vertex_index, relation_id)
+    report_throughput("Pass 2", start_time, len(entity_id_to_vertex_index), spiller.num_edges, num_bytes)
+
+    edges = spiller.load()
+    relation_id_to_name = {v: k for k, v in relation_name_to_id.items()}
+    # Vertex indices are assigned sequentially, so insertion order of the map is the vertex order.
+    vertex_index_to_entity_id = list(entity_id_to_vertex_index.keys())
+    write_processed_graph(output_dir, edges, vertex_index_to_entity_id, entity_id_to_name, relation_id_to_name, write_json)
+    shutil.rmtree(spill_dir, ignore_errors=True)
+
+    print("\nPreprocessing complete! All necessary files have been generated.")
 
-    print(f"  - Adding {len(edge_list)} edges to the graph in a single batch...")
-    g.add_edge_list(edge_list)
+
+def write_processed_graph(output_dir, edges, vertex_index_to_entity_id, entity_id_to_name, relation_id_to_name, write_json=False):
+    """edges is an (E, 3) array of (source vertex, target vertex, relation id) in insertion order."""
+    num_vertices = len(vertex_index_to_entity_id)
+    g = gt.Graph(directed=True)
+    if num_vertices:
+        g.add_vertex(num_vertices)
+    print(f"  - Adding {len(edges)} edges to the graph in a single batch...")
+    g.add_edge_list(edges[:, :2])
+
+    print("  - Building CSR adjacency (both directions, grouped by relation)...")
+    adjacency = build_adjacency(edges[:, 0], edges[:, 1], edges[:, 2], num_vertices)
 
     relation_prop = g.new_edge_property("int")
-    relation_prop.a = np.array(relation_property_list)
+    relation_prop.a = np.asarray(edges[:, 2])
     g.edge_properties["relation"] = relation_prop
-    relation_id_to_name = {v: k for k, v in relation_name_to_id.items()}
 
     print("Step 2: Saving processed files...")
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # --- Save all three files ---
     g.save(os.path.join(output_dir, "graph.gt"))
-    with open(os.path.join(output_dir, "entity_id_to_name.json"), 'w', encoding='utf-8') as f:
-        json.dump(entity_id_to_name, f, indent=4)
-    with open(os.path.join(output_dir, "relation_id_to_name.json"), 'w', encoding='utf-8') as f:
-        json.dump(relation_id_to_name, f, indent=4)
-    # *** NEW: Save the third, crucial mapping file ***
-    with open(os.path.join(output_dir, "entity_id_to_vertex_index.json"), 'w', encoding='utf-8') as f:
-        json.dump(entity_id_to_vertex_index, f, indent=4)
+    # Entity/relation maps are written as memory-mapped string tables (see grbench_index.py).
+    entity_names = [entity_id_to_name[entity_id] for entity_id in vertex_index_to_entity_id]
+    save_grbench_maps(
+        vertex_index_to_entity_id,
+        entity_names,
+        [relation_id_to_name[relation_id] for relation_id in range(len(relation_id_to_name))],
+        output_dir,
+    )
+    print("  - Building the entity name index for topic-entity linking...")
+    save_name_index(vertex_index_to_entity_id, entity_names, output_dir)
+    if write_json:
+        # Legacy JSON maps, only needed by tools that have not moved to the binary maps.
+        entity_id_to_vertex_index = {entity_id: i for i, entity_id in enumerate(vertex_index_to_entity_id)}
+        with open(os.path.join(output_dir, "entity_id_to_name.json"), 'w', encoding='utf-8') as f:
+            json.dump(entity_id_to_name, f)
+        with open(os.path.join(output_dir, "relation_id_to_name.json"), 'w', encoding='utf-8') as f:
+            json.dump(relation_id_to_name, f)
+        with open(os.path.join(output_dir, "entity_id_to_vertex_index.json"), 'w', encoding='utf-8') as f:
+            json.dump(entity_id_to_vertex_index, f)
+        with open(os.path.join(output_dir, "vertex_index_to_entity_id.json"), 'w', encoding='utf-8') as f:
+            json.dump(vertex_index_to_entity_id, f)
+    save_adjacency(adjacency, output_dir)
+
+
+
+# --- Batch mode: several domains, node-type sections split across a process pool ---
+# Workers are forked after the graph (and later the vertex map) is loaded, so they read
+# these module globals copy-on-write instead of receiving them through pickling.
+# Each section is stored as a list of (node_id, node_data) items, so a task reads only its own range.
+_GRAPH_DATA = None
+_ENTITY_ID_TO_VERTEX_INDEX = None
+
+
+def _iter_task_nodes(task):
+    node_type_key, start, end = task
+    return _GRAPH_DATA[node_type_key][start:end]
+
+
+def _collect_task_vertices(task):
+    name_feature = section_name_feature(task[0])
+    return [(node_id, node_data['features'].get(name_feature, "Unknown")) for node_id, node_data in _iter_task_nodes(task)]
+
+
+def _collect_task_edges(task):
+    # Relation ids are local to the task; they are remapped to global ids in task order when merging.
+    local_relation_ids = {}
+    edges = array('q')
+    for source_node_id, node_data in _iter_task_nodes(task):
+        source_vertex_index = _ENTITY_ID_TO_VERTEX_INDEX[source_node_id]
+        if 'neighbors' in node_data:
+            for relation_name, neighbor_ids in node_data['neighbors'].items():
+                relation_id = local_relation_ids.setdefault(relation_name, len(local_relation_ids))
+                for target_node_id in neighbor_ids:
+                    target_vertex_index = _ENTITY_ID_TO_VERTEX_INDEX.get(target_node_id)
+                    if target_vertex_index is not None:
+                        edges.extend((source_vertex_index, target_vertex_index, relation_id))
+    return list(local_relation_ids), np.frombuffer(edges, dtype=np.int64).reshape(-1, 3)
 
-    print("\nPreprocessing complete! All necessary files have been generated.")
 
+def split_sections(graph_data, num_tasks):
+    """Splits every node-type section into contiguous node ranges, in file order."""
+    tasks = []
+    for node_type_key, nodes in graph_data.items():
+        step = max(1, -(-len(nodes) // num_tasks))
+        tasks.extend((node_type_key, start, min(start + step, len(nodes))) for start in range(0, len(nodes), step))
+    return tasks
+
+
+def preprocess_domain_parallel(input_path, output_dir, num_workers, write_json=False):
+    """Same outputs as preprocess_graph_json; merging in task order keeps vertex and relation ids deterministic."""
+    global _GRAPH_DATA, _ENTITY_ID_TO_VERTEX_INDEX
+    timings = {}
+    context = multiprocessing.get_context("fork")
+
+    start_time = time.perf_counter()
+    print(f"Loading raw graph from: {input_path}...")
+    with open(input_path, 'r', encoding='utf-8') as f:
+        _GRAPH_DATA = {node_type_key: list(nodes.items()) for node_type_key, nodes in json.load(f).items()}
+    tasks = split_sections(_GRAPH_DATA, num_workers)
+    timings["load"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    entity_id_to_vertex_index, entity_id_to_name = {}, {}
+    # Frozen objects are left alone by the collector, which would otherwise touch (and so copy) every page in each worker.
+    gc.freeze()
+    with context.Pool(num_workers) as pool:
+        for task_vertices in pool.imap(_collect_task_vertices, tasks):
+            for node_id, name in task_vertices:
+                if node_id not in entity_id_to_vertex_index:
+                    entity_id_to_vertex_index[node_id] = len(entity_id_to_vertex_index)
+                    entity_id_to_name[node_id] = name
+    timings["vertices"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    _ENTITY_ID_TO_VERTEX_INDEX = entity_id_to_vertex_index
+    relation_name_to_id, edge_chunks = {}, []
+    gc.freeze()
+    with context.Pool(num_workers) as pool:
+        for local_relations, edges in pool.imap(_collect_task_edges, tasks):
+            for relation_name in local_relations:
+                relation_name_to_id.setdefault(relation_name, len(relation_name_to_id))
+            local_to_global = np.array([relation_name_to_id[name] for name in local_relations], dtype=np.int64)
+            if len(edges):
+                edges = edges.copy()
+                edges[:, 2] = local_to_global[edges[:, 2]]
+            edge_chunks.append(edges)
+    edges = np.concatenate(edge_chunks) if edge_chunks else np.zeros((0, 3), dtype=np.int64)
+    timings["edges"] = time.perf_counter() - start_time
+    _GRAPH_DATA, _ENTITY_ID_TO_VERTEX_INDEX = None, None
+    gc.unfreeze()
+
+    start_time = time.perf_counter()
+    relation_id_to_name = {v: k for k, v in relation_name_to_id.items()}
+    write_processed_graph(output_dir, edges, list(entity_id_to_vertex_index.keys()), entity_id_to_name, relation_id_to_name, write_json)
+    timings["write"] = time.perf_counter() - start_time
+    return timings
+
+
+def preprocess_domains(domains, graph_root, output_root, num_workers, write_json=False):
+    report = {}
+    for domain in domains:
+        print(f"\n=== Preprocessing domain '{domain}' ===")
+        report[domain] = preprocess_domain_parallel(
+            os.path.join(graph_root, domain, "graph.json"), os.path.join(output_root, domain), num_workers, write_json
+        )
+
+    stages = ["load", "vertices", "edges", "write"]
+    print("\nPer-stage timing (seconds):")
+    print(f"{'domain':<16}" + "".join(f"{stage:>10}" for stage in stages) + f"{'total':>10}")
+    for domain, timings in report.items():
+        print(f"{domain:<16}" + "".join(f"{timings[stage]:>10.1f}" for stage in stages) + f"{sum(timings.values()):>10.1f}")
+    return report
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Preprocess GRBench graph.json into optimized formats.")
     parser.add_argument("--input_graph_json", type=str, default="/shared/data3/hansont2/GRbench/graph/amazon/graph.json", help="Path to the raw graph.json file.")
-    parser.add_argument("--output_dir", type=str, default="/shared/data3/hansont2/GRbench/processed/amazon", help="Directory to save the processed files (graph.gt, entity_map.json, relation_map.json).")
+    parser.add_argument("--output_dir", type=str, default="/shared/data3/hansont2/GRbench/processed/amazon", help="Directory to save the processed files (graph.gt, csr/, maps/).")
+    parser.add_argument("--write_json", action="store_true", help="Also write the legacy JSON entity/relation/vertex maps.")
+    parser.add_argument("--streaming", action="store_true", help="Parse graph.json incrementally instead of loading it whole (bounded memory).")
+    parser.add_argument("--edge_chunk_size", type=int, default=1 << 22, help="Number of edges per NumPy chunk spilled to disk.")
+    parser.add_argument("--domains", type=str, nargs="+", default=None, help="Batch mode: domains to preprocess, read from <graph_root>/<domain>/graph.json.")
+    parser.add_argument("--graph_root", type=str, default="/shared/data3/hansont2/GRbench/graph", help="Batch mode: root directory of the raw domain graphs.")
+    parser.add_argument("--output_root", type=str, default="/shared/data3/hansont2/GRbench/processed", help="Batch mode: root directory for the processed domains.")
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count(), help="Batch mode: number of worker processes.")
     args = parser.parse_args()
-    
-    preprocess_graph_json(args.input_graph_json, args.output_dir)
\ No newline at end of file
+
+    if args.domains:
+        preprocess_domains(args.domains, args.graph_root, args.output_root, args.num_workers, args.write_json)
+    else:
+        preprocess_graph_json(args.input_graph_json, args.output_dir, args.write_json, args.streaming, args.edge_chunk_size)
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from grbench_index import load_grbench_maps
+
+# Embedding model of the sentencebert prune tool (trained for dot-product scoring).
+_MODEL_CONFIG = {"model_name": "sentence-transformers/msmarco-distilbert-base-tas-b", "cache_size": 200000, "batch_size": 64}
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+_CACHE = None
+_LABEL_INDEX = None
+
+
+def configure_sentence_model(**config):
+    """Sets model_name, cache_size or batch_size; must be called before the first encode."""
+    unknown = set(config) - set(_MODEL_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown sentence model options: {sorted(unknown)}")
+    _MODEL_CONFIG.update(config)
+
+
+def get_sentence_model():
+    """Returns the process-wide SentenceTransformer, loading it on first use."""
+    global _MODEL
+    with _MODEL_LOCK:
+        if _MODEL is None:
+            # Imported lazily: sentence_transformers (and torch) are only needed by the sentencebert tool.
+            from sentence_transformers import SentenceTransformer
+            print(f"Loading sentence model {_MODEL_CONFIG['model_name']}...")
+            _MODEL = SentenceTransformer(_MODEL_CONFIG["model_name"])
+        return _MODEL
+
+
+class EmbeddingCache:
+    """
+    text -> float32 embedding, LRU-bounded to max_entries. Pinned embeddings (precomputed labels)
+    are never evicted. encode() only sends the texts it has not seen to the model, in one batch.
+    Safe to share between threads.
+    """
+    def __init__(self, max_entries=200000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.pinned = {}
+
+    def pin(self, texts, embeddings):
+        with self.lock:
+            for text, embedding in zip(texts, embeddings):
+                self.pinned[text] = embedding
+
+    def _get(self, text):
+        embedding = self.pinned.get(text)
+        if embedding is None:
+            embedding = self.entries.get(text)
+            if embedding is not None:
+                self.entries.move_to_end(text)
+        return embedding
+
+    def encode(self, texts):
+        """Returns a (len(texts), dim) float32 matrix."""
+        with self.lock:
+            found = [self._get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, found) if embedding is None))
+        if missing:
+            encoded = get_sentence_model().encode(missing, batch_size=_MODEL_CONFIG["batch_size"], convert_to_numpy=True)
+            encoded = dict(zip(missing, np.asarray(encoded, dtype=np.float32)))
+            with self.lock:
+                for text, embedding in encoded.items():
+                    self.entries[text] = embedding
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            found = [embedding if embedding is not None else encoded[text] for text, embedding in zip(texts, found)]
+        return np.stack(found) if found else np.zeros((0, 0), dtype=np.float32)
+
+
+def get_embedding_cache():
+    global _CACHE
+    with _MODEL_LOCK:
+        if _CACHE is None:
+            _CACHE = EmbeddingCache(_MODEL_CONFIG["cache_size"])
+        return _CACHE
+
+
+def _npy_path(path):
+    return path if path.endswith(".npy") else path + ".npy"
+
+
+def save_embeddings(texts, path):
+    """Encodes texts once and writes them as path (.npy float32 matrix) plus path.labels.json."""
+    path = _npy_path(path)
+    texts = list(dict.fromkeys(texts))
+    embeddings = get_embedding_cache().encode(texts)
+    np.save(path, embeddings)
+    with open(path + ".labels.json", 'w', encoding='utf-8') as f:
+        json.dump(texts, f, ensure_ascii=False)
+
+
+def load_embeddings(path, mmap_mode='r'):
+    """Returns (labels, matrix) written by save_embeddings; the matrix is memory-mapped."""
+    path = _npy_path(path)
+    with open(path + ".labels.json", 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+    return labels, np.load(path, mmap_mode=mmap_mode)
+
+
+class LabelEmbeddingIndex:
+    """
+    Precomputed embedding matrix of a fixed label vocabulary (relation labels). Scoring a candidate
+    subset is one gather, one matrix-vector product and an argpartition, with no model call.
+    """
+    def __init__(self, labels, matrix):
+        self.matrix = matrix
+        self.rows = {label: row for row, label in enumerate(labels)}
+
+    def covers(self, labels):
+        return all(label in self.rows for label in labels)
+
+    def top_k(self, query_embedding, candidates, k):
+        """Returns the k best candidates (all must be indexed) and their scores, best first."""
+        rows = np.fromiter((self.rows[label] for label in candidates), dtype=np.int64, count=len(candidates))
+        scores = np.asarray(self.matrix[rows] @ query_embedding, dtype=np.float32)
+        return _top_k(candidates, scores, k)
+
+
+def _top_k(docs, scores, k):
+    if k < len(scores):
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+    else:
+        best = np.argsort(-scores, kind='stable')
+    return [docs[i] for i in best], [float(scores[i]) for i in best]
+
+
+def preload_embeddings(path):
+    """
+    Loads precomputed label embeddings: they serve as the label index of retrieve_top_docs and are
+    pinned in the shared cache, so these labels are never re-encoded.
+    """
+    global _LABEL_INDEX
+    labels, matrix = load_embeddings(path)
+    _LABEL_INDEX = LabelEmbeddingIndex(labels, matrix)
+    get_embedding_cache().pin(labels, matrix)
+    print(f"Loaded {len(labels)} precomputed embeddings from {path}.")
+
+
+def index_labels(labels):
+    """Encodes a fixed label vocabulary once and uses it as the label index of retrieve_top_docs."""
+    global _LABEL_INDEX
+    labels = list(dict.fromkeys(labels))
+    _LABEL_INDEX = LabelEmbeddingIndex(labels, get_embedding_cache().encode(labels))
+
+
+def retrieve_top_docs(query, docs, width=3):
+    """
+    Retrieve the topn most relevant documents for the given query (dot-product score).
+    """
+    if not docs:
+        return [], []
+    cache = get_embedding_cache()
+    if _LABEL_INDEX is not None and _LABEL_INDEX.covers(docs):
+        return _LABEL_INDEX.top_k(cache.encode([query])[0], docs, width)
+    embeddings = cache.encode([query] + list(docs))
+    return _top_k(docs, embeddings[1:] @ embeddings[0], width)
+
+
+def sentence_scores(query, docs):
+    """Dot-product scores of docs (aligned with docs) for query."""
+    if not docs:
+        return []
+    embeddings = get_embedding_cache().encode([query] + list(docs))
+    return [float(score) for score in embeddings[1:] @ embeddings[0]]
+
+
+def read_labels(path):
+    """
+    Labels from a GRBench maps directory (its relation names), a JSON list, the values of a JSON object
+    (e.g. relation_id_to_name.json), or a text file with one label per line.
+    """
+    if os.path.isdir(path):
+        return list(load_grbench_maps(path)[1].values())
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return list(data.values()) if isinstance(data, dict) else list(data)
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Embed a fixed label vocabulary (e.g. all relation labels) once for the sentencebert prune tool.")
+    parser.add_argument("--labels", type=str, nargs='+', required=True,
+                        help="label sources: the maps directory written by preprocess_grbench.py (GRBench), a pid -> name JSON map (Wikidata) or a text file with one relation per line (Freebase).")
+    parser.add_argument("--output", type=str, required=True, help="output .npy file, pass it to the main scripts with --sentence_embeddings.")
+    parser.add_argument("--sentence_model", type=str, default=_MODEL_CONFIG["model_name"], help="embedding model.")
+    parser.add_argument("--batch_size", type=int, default=_MODEL_CONFIG["batch_size"], help="encoding batch size.")
+    args = parser.parse_args()
+
+    configure_sentence_model(model_name=args.sentence_model, batch_size=args.batch_size)
+    labels = [label for path in args.labels for label in read_labels(path)]
+    save_embeddings(labels, args.output)
+    print(f"Saved embeddings of {len(set(labels))} labels to {_npy_path(args.output)}.")
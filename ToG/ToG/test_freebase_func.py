@@ -0,0 +1,101 @@
+import re
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("openai")
+
+import freebase_func
+from freebase_func import FREEBASE_PREFIX, entity_names, entity_relations_batch, entity_search_batch
+
+MAX_ROWS = 10
+
+# One hub pair has more tail entities than a whole result may hold; the other pairs have a few each.
+TRIPLES = [("m.hub", "r.big", f"m.t{i:02d}") for i in range(35)]
+TRIPLES += [(f"m.e{i}", "r.small", f"m.s{i}{j}") for i in range(12) for j in range(i % 3 + 1)]
+TRIPLES += [("m.hub", f"r.rel{i:02d}", "m.x") for i in range(25)]
+NAMES = {f"m.e{i}": f"entity {i}" for i in range(12)}
+
+
+def binding(**values):
+    return {var: {"value": value if var in ("name", "isHead") else FREEBASE_PREFIX + value} for var, value in values.items()}
+
+
+class FakeEndpoint:
+    """Evaluates the batched query templates over TRIPLES and cuts every result off at MAX_ROWS, like Virtuoso."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, sparql_query):
+        self.queries.append(sparql_query)
+        values = re.search(r"VALUES .*?\{ (.*) \}", sparql_query).group(1)
+        keys = re.findall(r"\(ns:(\S+) ns:(\S+)\)", values) or re.findall(r"ns:(\S+)", values)
+        if "?isHead" in sparql_query:
+            rows = {(e, r, "1") for e in keys for h, r, t in TRIPLES if h == e}
+            rows |= {(e, r, "0") for e in keys for h, r, t in TRIPLES if t == e}
+            rows = [binding(entity=e, relation=r, isHead=h) for e, r, h in rows]
+        elif "?name" in sparql_query:
+            rows = [binding(entity=e, name=NAMES[e]) for e in keys if e in NAMES]
+        elif "?entity ?relation ?tailEntity ." in sparql_query:
+            rows = [binding(entity=h, relation=r, tailEntity=t) for h, r, t in TRIPLES if (h, r) in keys]
+        else:
+            rows = [binding(entity=t, relation=r, tailEntity=h) for h, r, t in TRIPLES if (t, r) in keys]
+        page = re.search(r"ORDER BY .*\n\}\nLIMIT (\d+) OFFSET (\d+)$", sparql_query)
+        if page:
+            rows.sort(key=lambda row: sorted((var, value["value"]) for var, value in row.items()))
+            limit, offset = int(page.group(1)), int(page.group(2))
+            rows = rows[offset:offset + limit]
+        return rows[:MAX_ROWS]
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    fake = FakeEndpoint()
+    monkeypatch.setattr(freebase_func, "execurte_sparql", fake)
+    monkeypatch.setitem(freebase_func._SPARQL_CONFIG, "max_rows", MAX_ROWS)
+    monkeypatch.setitem(freebase_func._SPARQL_CONFIG, "batch_size", 8)
+    monkeypatch.setattr(freebase_func, "_NAME_CACHE", {})
+    return fake
+
+
+def test_entity_search_batch_keeps_candidates_of_every_pair(endpoint):
+    requests_list = [("m.hub", "r.big", True)] + [(f"m.e{i}", "r.small", True) for i in range(12)]
+    requests_list += [("m.t07", "r.big", False), ("m.s40", "r.small", False)]
+
+    results = entity_search_batch(requests_list)
+
+    for (entity, relation, head), candidates in zip(requests_list, results):
+        if head:
+            expected = [t for h, r, t in TRIPLES if (h, r) == (entity, relation)]
+        else:
+            expected = [h for h, r, t in TRIPLES if (t, r) == (entity, relation)]
+        assert sorted(candidates) == sorted(expected)
+    # The hub pair alone fills a result, so it was read page by page.
+    assert any("OFFSET 30" in query for query in endpoint.queries)
+
+
+def test_entity_relations_batch_keeps_relations_of_every_entity(endpoint):
+    entity_ids = ["m.hub"] + [f"m.e{i}" for i in range(12)] + ["m.x"]
+
+    relations = entity_relations_batch(entity_ids)
+
+    assert sorted(relations["m.hub"][0]) == sorted({r for h, r, t in TRIPLES if h == "m.hub"})
+    assert relations["m.x"][0] == [] and sorted(relations["m.x"][1]) == [f"r.rel{i:02d}" for i in range(25)]
+    for i in range(12):
+        assert relations[f"m.e{i}"] == (["r.small"], [])
+
+
+def test_entity_names_are_batched(endpoint):
+    names = entity_names([f"m.e{i}" for i in range(12)] + ["m.unknown"])
+    assert names["m.e3"] == "entity 3" and names["m.unknown"] == "UnName_Entity"
+    assert len(endpoint.queries) == 2  # batch_size names per query
+
+
+def test_single_key_paging_stops_at_max_key_rows(endpoint, monkeypatch):
+    monkeypatch.setitem(freebase_func._SPARQL_CONFIG, "max_key_rows", 20)
+    assert len(entity_search_batch([("m.hub", "r.big", True)])[0]) == 20
+
+
+def test_configure_sparql_rejects_unknown_options():
+    with pytest.raises(ValueError):
+        freebase_func.configure_sparql(batchsize=10)
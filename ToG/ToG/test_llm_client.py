@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+openai = pytest.importorskip("openai")
+
+import llm_client
+from llm_client import AsyncLLMClient, ERROR_RESPONSE
+
+
+def api_error(error_class, status_code):
+    # The SDK errors only read these attributes of the HTTP response.
+    response = SimpleNamespace(status_code=status_code, request=None, headers={})
+    return error_class("error", response=response, body=None)
+
+
+class FakeCompletions:
+    """Raises the queued errors in turn, then answers."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        message = type("Message", (), {"content": "answer"})
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+
+def run_chat(errors, monkeypatch, max_retries=3):
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    async def chat():
+        client = AsyncLLMClient("key", max_retries=max_retries)
+        completions = FakeCompletions(errors)
+        client.client.chat.completions = completions
+        return await client.chat("prompt", 0, 16), completions.calls
+
+    monkeypatch.setattr(llm_client.asyncio, "sleep", fake_sleep)
+    response, calls = asyncio.run(chat())
+    return response, calls, sleeps
+
+
+@pytest.mark.parametrize("error", [
+    api_error(openai.RateLimitError, 429),
+    api_error(openai.InternalServerError, 503),
+    openai.APITimeoutError(request=None),
+])
+def test_transient_errors_are_retried(error, monkeypatch):
+    response, calls, sleeps = run_chat([error], monkeypatch)
+    assert response == "answer" and calls == 2 and len(sleeps) == 1
+
+
+@pytest.mark.parametrize("error", [
+    api_error(openai.BadRequestError, 400),
+    api_error(openai.AuthenticationError, 401),
+    api_error(openai.NotFoundError, 404),
+    ValueError("bad response"),
+])
+def test_permanent_errors_fail_fast(error, monkeypatch):
+    response, calls, sleeps = run_chat([error], monkeypatch)
+    assert response == ERROR_RESPONSE and calls == 1 and sleeps == []
+
+
+def test_no_sleep_after_the_last_attempt(monkeypatch):
+    response, calls, sleeps = run_chat([api_error(openai.RateLimitError, 429)] * 3, monkeypatch)
+    assert response == ERROR_RESPONSE and calls == 3 and len(sleeps) == 2
@@ -0,0 +1,45 @@
+import numpy as np
+import name_index
+from name_index import build_name_index, save_name_index, load_name_index
+
+
+def synthetic_names(num_names, seed=0):
+    """Product-like names: a few rare tokens plus common words shared by a large part of the index."""
+    rng = np.random.default_rng(seed)
+    common = ["the", "black", "for", "with", "and", "pack", "new", "set"]
+    medium = rng.integers(num_names // 20, size=num_names)
+    small = rng.integers(num_names // 2, size=num_names)
+    shift = rng.integers(len(common), size=num_names)
+    return [f"r{i} m{medium[i]} s{small[i]} {common[shift[i]]} {common[shift[i] - 3]} {common[shift[i] - 5]}"
+            for i in range(num_names)]
+
+
+def postings_read(index, text):
+    token_ids, _ = index._query(text)
+    return sum(int(index.postings_offsets[t + 1] - index.postings_offsets[t]) for t in index._candidate_tokens(token_ids))
+
+
+def test_common_tokens_do_not_generate_candidates():
+    names = synthetic_names(20000)
+    index = build_name_index([f"e{i}" for i in range(len(names))], names)
+
+    # "black" and "the" each appear in thousands of names but are skipped; the rare tokens still match.
+    name = names[1234]
+    question = f"What brand does the item {name} belong to and is it black?"
+    assert postings_read(index, question) <= name_index.MAX_CANDIDATE_POSTINGS
+    assert postings_read(index, "the black pack") == 0
+    assert index.lookup("the black pack") is None
+    entity_id, coverage = index.find_in_text(question)
+    assert entity_id == "e1234" and coverage > 0.99
+    assert index.lookup(" ".join(name.split()[:-1]))[0] == "e1234"
+
+
+def test_saved_index_finds_names_in_questions(tmp_path):
+    names = synthetic_names(100000)
+    save_name_index([f"e{i}" for i in range(len(names))], names, str(tmp_path))
+    index = load_name_index(str(tmp_path / name_index.NAME_INDEX_DIR_NAME))
+
+    for i in range(0, len(names), len(names) // 200):
+        question = f"How many items are in the brand of {names[i]}?"
+        assert postings_read(index, question) <= name_index.MAX_CANDIDATE_POSTINGS
+        assert index.find_in_text(question)[0] == f"e{i}"
@@ -1,32 +1,28 @@
+import atexit
+import gzip
 import json
+import os
+import queue
 import time
-import openai
+import threading
+import zlib
 import re
+from concurrent.futures import ThreadPoolExecutor
 from prompt_list import *
-
-def retrieve_top_docs(query, docs, model, width=3):
-    """
-    Retrieve the topn most relevant documents for the given query.
-    """
-    query_emb = model.encode(query)
-    doc_emb = model.encode(docs)
-    scores = util.dot_score(query_emb, doc_emb)[0].cpu().tolist()
-    doc_score_pairs = sorted(list(zip(docs, scores)), key=lambda x: x[1], reverse=True)
-    top_docs = [pair[0] for pair in doc_score_pairs[:width]]
-    top_scores = [pair[1] for pair in doc_score_pairs[:width]]
-    return top_docs, top_scores
+from llm_client import get_llm_client, configure_llm_client, ERROR_RESPONSE
+from llm_cache import enable_llm_cache, get_llm_cache
+from sentence_embedding import configure_sentence_model, preload_embeddings, index_labels, retrieve_top_docs, sentence_scores, read_labels
+from bm25_index import get_bm25_index, set_bm25_vocabulary
 
 def compute_bm25_similarity(query, corpus, width=3):
     """
-    Computes BM25 similarity and returns the topn relations and scores.
+    Computes BM25 similarity and returns the topn relations and their scores, best first.
     """
-    tokenized_corpus = [doc.split(" ") for doc in corpus]
-    bm25 = BM25Okapi(tokenized_corpus)
-    tokenized_query = query.split(" ")
-    doc_scores = bm25.get_scores(tokenized_query)
-    relations = bm25.get_top_n(tokenized_query, corpus, n=width)
-    doc_scores = sorted(doc_scores, reverse=True)[:width]
-    return relations, doc_scores
+    return get_bm25_index(corpus).top_n(query, corpus, width)
+
+def bm25_scores(query, corpus):
+    """BM25 scores aligned with corpus."""
+    return get_bm25_index(corpus).scores(query, corpus)
 
 def clean_relations(string, entity_id, head_relations):
     pattern = r"{\s*(?P<relation>[^()]+)\s+\(Score:\s+(?P<score>[0-9.]+)\)}"
@@ -67,32 +63,103 @@ def clean_relations_bm25_sent(topn_relations, topn_scores, entity_id, head_relat
     return True, relations
 
 def run_llm(prompt, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
-    # Set the API key for the OpenAI library
-    openai.api_key = opeani_api_keys
+    # Blocking call through the shared async client (connection reuse, rate limits, backoff with jitter),
+    # so callers in different threads run their requests in parallel.
+    cache = get_llm_cache()
+    if cache is not None:
+        cached = cache.get(engine, prompt, temperature, max_tokens)
+        if cached is not None:
+            return cached
+    response = get_llm_client(opeani_api_keys).chat(prompt, temperature, max_tokens, engine)
+    if cache is not None and response != ERROR_RESPONSE:
+        cache.put(engine, prompt, temperature, max_tokens, response)
+    return response
 
-    messages = [{"role":"system", "content":"You are an AI assistant that helps people find information."}]
-    message_prompt = {"role":"user", "content":prompt}
-    messages.append(message_prompt)
-    
-    retries = 3
-    for i in range(retries):
-        try:
-            response = openai.ChatCompletion.create(
-                    model=engine,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    frequency_penalty=0,
-                    presence_penalty=0
-            )
-            return response["choices"][0]['message']['content']
-        except Exception as e:
-            print(f"OpenAI API error: {e}. Retrying in 2 seconds...")
-            time.sleep(2)
-    
-    print("All OpenAI API retries failed.")
-    return "Error: Could not get a response from the language model."
+def run_llm_parallel(prompts, temperature, max_tokens, opeani_api_keys, engine="gpt-3.5-turbo"):
+    """Issues several prompts concurrently; responses are returned in prompt order."""
+    cache = get_llm_cache()
+    responses = [cache.get(engine, prompt, temperature, max_tokens) if cache is not None else None for prompt in prompts]
+    missing = [i for i, response in enumerate(responses) if response is None]
+    if missing:
+        fetched = get_llm_client(opeani_api_keys).chat_many([prompts[i] for i in missing], temperature, max_tokens, engine)
+        for i, response in zip(missing, fetched):
+            responses[i] = response
+            if cache is not None and response != ERROR_RESPONSE:
+                cache.put(engine, prompts[i], temperature, max_tokens, response)
+    return responses
+
+_FANOUT_WORKERS = 16
+_FANOUT_EXECUTOR = None
+_FANOUT_LOCK = threading.Lock()
+
+def run_in_parallel(func, arg_tuples):
+    """
+    Calls func(*args) for every tuple concurrently and returns the results in input order. Used to
+    dispatch the independent prune/score calls of one search depth together (max-of-calls latency).
+    """
+    global _FANOUT_EXECUTOR
+    arg_tuples = list(arg_tuples)
+    if len(arg_tuples) <= 1 or _FANOUT_WORKERS <= 1:
+        return [func(*args) for args in arg_tuples]
+    with _FANOUT_LOCK:
+        if _FANOUT_EXECUTOR is None:
+            # Separate from any per-question pool, so waiting on fan-out tasks can never deadlock.
+            _FANOUT_EXECUTOR = ThreadPoolExecutor(max_workers=_FANOUT_WORKERS)
+    futures = [_FANOUT_EXECUTOR.submit(func, *args) for args in arg_tuples]
+    return [future.result() for future in futures]
+
+def add_llm_client_args(parser):
+    parser.add_argument("--llm_concurrency", type=int,
+                        default=8, help="max number of in-flight LLM requests.")
+    parser.add_argument("--requests_per_minute", type=int,
+                        default=None, help="LLM request rate limit (unlimited by default).")
+    parser.add_argument("--tokens_per_minute", type=int,
+                        default=None, help="LLM token rate limit (unlimited by default).")
+    parser.add_argument("--llm_max_retries", type=int,
+                        default=5, help="attempts per LLM request, with exponential backoff and jitter.")
+    parser.add_argument("--fanout_workers", type=int,
+                        default=16, help="threads for the concurrent relation-prune/entity-score calls of one depth (1 disables fan-out).")
+    parser.add_argument("--llm_cache", type=str,
+                        default=None, help="path of a SQLite file caching LLM responses across runs (disabled by default).")
+    parser.add_argument("--llm_cache_max_mb", type=int,
+                        default=1024, help="size budget of the LLM response cache, least recently used entries are evicted.")
+
+def configure_llm_from_args(args):
+    global _FANOUT_WORKERS
+    _FANOUT_WORKERS = args.fanout_workers
+    configure_llm_client(
+        max_concurrency=args.llm_concurrency,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        max_retries=args.llm_max_retries,
+    )
+    if args.llm_cache:
+        enable_llm_cache(args.llm_cache, args.llm_cache_max_mb << 20)
     
+def add_prune_tool_args(parser):
+    parser.add_argument("--sentence_model", type=str,
+                        default="sentence-transformers/msmarco-distilbert-base-tas-b", help="embedding model of the sentencebert prune tool.")
+    parser.add_argument("--sentence_embeddings", type=str,
+                        default=None, help="optional .npy file of precomputed label embeddings (see sentence_embedding.save_embeddings).")
+    parser.add_argument("--embedding_cache_size", type=int,
+                        default=200000, help="max number of question/entity embeddings kept in memory.")
+    parser.add_argument("--bm25_vocabulary", type=str, nargs='*',
+                        default=None, help="label sources (e.g. a GRBench maps directory, see sentence_embedding.read_labels) whose BM25 term statistics are precomputed once for the bm25 prune tool.")
+
+def configure_prune_tools_from_args(args, relation_labels=None):
+    """relation_labels: the relation vocabulary, when the knowledge graph has a fixed one (GRBench) to index up front."""
+    configure_sentence_model(model_name=args.sentence_model, cache_size=args.embedding_cache_size)
+    if args.prune_tools == "sentencebert":
+        if args.sentence_embeddings:
+            preload_embeddings(args.sentence_embeddings)
+        elif relation_labels:
+            index_labels(relation_labels)
+    if args.prune_tools == "bm25":
+        if args.bm25_vocabulary:
+            set_bm25_vocabulary([label for path in args.bm25_vocabulary for label in read_labels(path)])
+        elif relation_labels:
+            set_bm25_vocabulary(relation_labels)
+
 def all_unknown_entity(entity_candidates):
     return all(candidate == "UnName_Entity" for candidate in entity_candidates)
 
@@ -111,12 +178,206 @@ def clean_scores(string, entity_candidates):
         print("All entities are created equal.")
         return [1/len(entity_candidates)] * len(entity_candidates)
     
-def save_2_jsonl(question, answer, cluster_chain_of_entities, file_name):
-    data_dict = {"question": question, "results": answer, "reasoning_chains": cluster_chain_of_entities}
-    with open(f"ToG_{file_name}.jsonl", "a") as outfile:
-        json_str = json.dumps(data_dict)
-        outfile.write(json_str + "\n")
-    
+_OUTPUT_CONFIG = {"output_dir": ".", "compress": False, "fsync_interval": 5.0}
+_RESULT_SINKS = {}
+_RESULT_SINKS_LOCK = threading.Lock()
+
+class ResultSink:
+    """
+    Appends JSON lines to one file through a long-lived buffered handle owned by a writer thread.
+    Producers only enqueue complete lines, so concurrent writers never interleave partial lines.
+    The file is flushed and fsynced at most every fsync_interval seconds and on close().
+    Paths ending in .gz are written gzip-compressed.
+    """
+    def __init__(self, path, fsync_interval=5.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        if path.endswith(".gz"):
+            self.file = gzip.open(path, "ab")
+        else:
+            self.file = open(path, "ab", buffering=1 << 20)
+        self.queue = queue.Queue()
+        self.error = None
+        self.closed = False
+        # Daemon thread: non-daemon threads are joined before atexit handlers (which close the sinks) run.
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        if self.error:
+            raise self.error
+        self.queue.put((json.dumps(record) + "\n").encode("utf-8"))
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                line = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                line = b""
+            try:
+                if line is None:
+                    self._sync()
+                    return
+                self.file.write(line)
+                if time.monotonic() - last_sync >= self.fsync_interval:
+                    self._sync()
+                    last_sync = time.monotonic()
+            except Exception as e:
+                print(f"Error while writing results to {self.path}: {e}")
+                self.error = e
+                return
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+def configure_result_output(**config):
+    """Sets output_dir, compress or fsync_interval for result files opened afterwards."""
+    unknown = set(config) - set(_OUTPUT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown output options: {sorted(unknown)}")
+    _OUTPUT_CONFIG.update(config)
+
+def result_path(file_name):
+    suffix = ".jsonl.gz" if _OUTPUT_CONFIG["compress"] else ".jsonl"
+    return os.path.join(_OUTPUT_CONFIG["output_dir"], f"ToG_{file_name}{suffix}")
+
+def get_result_sink(file_name):
+    """Returns the process-wide sink of ToG_{file_name}.jsonl[.gz], opening it on first use."""
+    path = result_path(file_name)
+    with _RESULT_SINKS_LOCK:
+        if path not in _RESULT_SINKS:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            _RESULT_SINKS[path] = ResultSink(path, _OUTPUT_CONFIG["fsync_interval"])
+        return _RESULT_SINKS[path]
+
+def close_result_sinks():
+    with _RESULT_SINKS_LOCK:
+        for sink in _RESULT_SINKS.values():
+            sink.close()
+        _RESULT_SINKS.clear()
+
+atexit.register(close_result_sinks)
+
+def save_2_jsonl(question, answer, cluster_chain_of_entities, file_name, **fields):
+    data_dict = {"question": question, "results": answer, "reasoning_chains": cluster_chain_of_entities, **fields}
+    get_result_sink(file_name).write(data_dict)
+
+def load_completed_questions(file_name):
+    """
+    Returns the set of questions already answered in the result file. A partial last record left by
+    a crash is dropped, so that records appended by the resumed run start on a fresh line.
+    """
+    path = result_path(file_name)
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    compressed = path.endswith(".gz")
+    valid_lines = []
+    valid_bytes = 0
+    truncated = False
+    with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as f:
+        try:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    truncated = True
+                    break
+                try:
+                    completed.add(json.loads(line)["question"])
+                except (ValueError, KeyError):
+                    print(f"Skipping unreadable line in {path}.")
+                valid_bytes += len(line)
+                if compressed:
+                    valid_lines.append(line)
+        except (EOFError, OSError, zlib.error):
+            # A gzip stream cut off mid-member.
+            truncated = True
+    if truncated:
+        print(f"Dropping a partial last record of {path}.")
+        if compressed:
+            # A cut-off gzip member cannot be appended to, so the readable records are rewritten.
+            with gzip.open(path + ".tmp", 'wb') as f:
+                f.writelines(valid_lines)
+            os.replace(path + ".tmp", path)
+        else:
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)
+    return completed
+
+class SearchCheckpoint:
+    """
+    In-flight search states (question -> JSON-serialisable dict) of a run, written to disk at most
+    every flush_interval seconds. Writes go through a temporary file and os.replace, so a crash
+    never leaves a half-written checkpoint. Safe to share between threads.
+    """
+    def __init__(self, path, flush_interval=30, load=True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.states = {}
+        if load and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.states = json.load(f)
+            print(f"Loaded {len(self.states)} in-flight searches from {path}.")
+        self.last_flush = time.monotonic()
+        self.dirty = False
+
+    def get(self, question):
+        with self.lock:
+            return self.states.get(question)
+
+    def update(self, question, state):
+        with self.lock:
+            self.states[question] = state
+            self.dirty = True
+        self._maybe_flush()
+
+    def discard(self, question):
+        with self.lock:
+            if self.states.pop(question, None) is not None:
+                self.dirty = True
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.states, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            self.last_flush = time.monotonic()
+
+def add_output_args(parser):
+    parser.add_argument("--output_dir", type=str,
+                        default=".", help="directory of the ToG_{dataset}.jsonl result file.")
+    parser.add_argument("--compress_output", action="store_true",
+                        help="write the results gzip-compressed (ToG_{dataset}.jsonl.gz).")
+    parser.add_argument("--fsync_interval", type=float,
+                        default=5.0, help="seconds between flushes/fsyncs of the result file.")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip questions already answered in the output file and continue checkpointed searches.")
+    parser.add_argument("--checkpoint_interval", type=float,
+                        default=30, help="seconds between flushes of the in-flight search checkpoint.")
+
+def configure_output_from_args(args):
+    configure_result_output(output_dir=args.output_dir, compress=args.compress_output, fsync_interval=args.fsync_interval)
+
 def extract_answer(text):
     start_index = text.find("{")
     end_index = text.find("}")
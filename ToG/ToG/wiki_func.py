@@ -54,8 +54,10 @@ def construct_entity_score_prompt(question, relation, entity_candidates):
     return score_entity_candidates_prompt_wiki.format(question, relation) + "; ".join(entity_candidates) + '\nScore: '
 
 
-def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, wiki_client):
-    relations = wiki_client.query_all("get_all_relations_of_an_entity", entity_id)
+def relation_search_prune(entity_id, entity_name, pre_relations, pre_head, question, args, wiki_client, relations=None):
+    """relations: optional result of get_all_relations_of_an_entity prefetched with get_all_relations_batch."""
+    if relations is None:
+        relations = wiki_client.query_all("get_all_relations_of_an_entity", entity_id)
     head_relations = [rel['label'] for rel in relations['head']]
     tail_relations = [rel['label'] for rel in relations['tail']]
     if args.remove_unnecessary_rel:
@@ -124,6 +126,34 @@ def entity_search(entity, relation, wiki_client, head):
     return id_list, name_list
 
 
+def entity_search_batch(requests_list, wiki_client):
+    """
+    Batched entity_search: requests_list holds (entity, relation, head) tuples; returns the (id_list, name_list)
+    pairs in the same order. The tail entities of all (entity, pid) pairs come from one call per server.
+    """
+    relation_pids = {}
+    for relation in dict.fromkeys(relation for _, relation, _ in requests_list):
+        rid = wiki_client.query_all("label2pid", relation)
+        relation_pids[relation] = rid.pop() if rid and rid != "Not Found!" else None
+    pairs = list(dict.fromkeys((entity, relation_pids[relation]) for entity, relation, _ in requests_list if relation_pids[relation]))
+    pair_entities = dict(zip(pairs, wiki_client.get_tail_entities_batch(pairs)))
+
+    results = []
+    for entity, relation, head in requests_list:
+        rid_str = relation_pids[relation]
+        if rid_str is None:
+            results.append(([], []))
+            continue
+        entities_set = pair_entities[(entity, rid_str)]['tail' if head else 'head']
+        if not entities_set:
+            values = wiki_client.query_all("get_tail_values_given_head_and_relation", entity, rid_str)
+            results.append(([], list(values)))
+            continue
+        results.append(([item['qid'] for item in entities_set],
+                        [item['label'] if item['label'] != "N/A" else "Unname_Entity" for item in entities_set]))
+    return results
+
+
 def entity_score(question, entity_candidates_id, entity_candidates, score, relation, args):
     if len(entity_candidates) == 1:
         return [score], entity_candidates, entity_candidates_id
@@ -186,7 +216,7 @@ def entity_prune(total_entities_id, total_relations, total_candidates, total_top
     if len(filtered_list) ==0:
         return False, [], [], [], []
     entities_id, relations, candidates, tops, heads, scores = map(list, zip(*filtered_list))
-    tops = [wiki_client.query_all("qid2label", entity_id).pop() if (entity_name := wiki_client.query_all("qid2label", entity_id)) != "Not Found!" else "Unname_Entity" for entity_id in tops]
+    tops = [label if label != "Not Found!" else "Unname_Entity" for label in wiki_client.qid2label_batch(tops)]
     cluster_chain_of_entities = [[(tops[i], relations[i], candidates[i]) for i in range(len(candidates))]]
     return True, cluster_chain_of_entities, entities_id, relations, heads
 
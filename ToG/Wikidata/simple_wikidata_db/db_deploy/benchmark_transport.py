@@ -0,0 +1,142 @@
+import gzip
+import random
+import threading
+import time
+import typing as tp
+import xmlrpc.client
+from collections import defaultdict
+from xmlrpc.server import SimpleXMLRPCServer
+import numpy as np
+from simple_wikidata_db.db_deploy.msgpack_rpc import MsgpackRPCProxy, MsgpackRPCServer
+from simple_wikidata_db.db_deploy.utils import Entity, Relation, a_factory
+
+
+class CountingTransport(xmlrpc.client.Transport):
+    """XML-RPC transport that counts request and response body bytes as sent on the wire."""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send_content(self, connection, request_body):
+        self.bytes_sent += len(request_body)
+        super().send_content(connection, request_body)
+
+    def parse_response(self, response):
+        body = response.read()
+        self.bytes_received += len(body)
+        if response.getheader("Content-Encoding", "") == "gzip":
+            body = gzip.decompress(body)
+        parser, unmarshaller = self.getparser()
+        parser.feed(body)
+        parser.close()
+        return unmarshaller.close()
+
+
+class SyntheticIndex:
+    """Random relation / tail-entity index with the same result shapes as WikidataQueryServer."""
+
+    def __init__(self, num_entities: int, edges_per_entity: int, seed: int = 0):
+        rng = random.Random(seed)
+        self.qids = [f"Q{rng.randint(1, 10**8)}" for _ in range(num_entities)]
+        self.relation_entities = defaultdict(a_factory)
+        self.tail_entities = defaultdict(a_factory)
+        for qid in self.qids:
+            for _ in range(rng.randint(1, 2 * edges_per_entity)):
+                pid = f"P{rng.randint(1, 3000)}"
+                tail = rng.choice(self.qids)
+                rel = Relation(pid=pid, label=f"relation label {pid}")
+                self.relation_entities[qid]["head"].append(rel)
+                self.relation_entities[tail]["tail"].append(rel)
+                self.tail_entities[f"{qid}@{pid}"]["tail"].append(Entity(qid=tail, label=f"entity label {tail}"))
+                self.tail_entities[f"{tail}@{pid}"]["head"].append(Entity(qid=qid, label=f"entity label {qid}"))
+
+    def get_all_relations_of_an_entity(self, entity_qid: str):
+        return self.relation_entities.get(entity_qid, "Not Found!")
+
+    def get_all_relations_batch(self, entity_qids: tp.List[str]):
+        return [self.get_all_relations_of_an_entity(qid) for qid in entity_qids]
+
+
+def start_synthetic_servers(index: SyntheticIndex) -> tp.Dict[str, str]:
+    servers = {
+        "xmlrpc": SimpleXMLRPCServer(("127.0.0.1", 0), logRequests=False),
+        "msgpack": MsgpackRPCServer(("127.0.0.1", 0)),
+    }
+    urls = {}
+    for protocol, server in servers.items():
+        server.register_function(index.get_all_relations_of_an_entity)
+        server.register_function(index.get_all_relations_batch)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        scheme = "msgpack" if protocol == "msgpack" else "http"
+        urls[protocol] = f"{scheme}://127.0.0.1:{server.server_address[1]}"
+    return urls
+
+
+def make_proxy(url: str):
+    """Returns (proxy, byte counter object) for an http:// or msgpack:// URL."""
+    if url.startswith("msgpack://"):
+        proxy = MsgpackRPCProxy(url)
+        return proxy, proxy
+    transport = CountingTransport()
+    return xmlrpc.client.ServerProxy(url, transport=transport), transport
+
+
+def run(url: str, method: str, calls: tp.List[tp.List]) -> tp.Dict[str, float]:
+    proxy, counter = make_proxy(url)
+    getattr(proxy, method)(*calls[0])  # warm up the connection
+    counter.bytes_sent = counter.bytes_received = 0
+    latencies = []
+    for params in calls:
+        start = time.perf_counter()
+        getattr(proxy, method)(*params)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "request_bytes": counter.bytes_sent / len(calls),
+        "response_bytes": counter.bytes_received / len(calls),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare bytes on wire and latency of the XML-RPC and msgpack transports."
+    )
+    parser.add_argument("--xmlrpc_url", type=str, default=None, help="http:// URL of a server started with --protocol xmlrpc")
+    parser.add_argument("--msgpack_url", type=str, default=None, help="msgpack:// URL of a server of the same chunk started with --protocol msgpack")
+    parser.add_argument("--qids", type=str, default=None, help="file with one QID per line to query (required with server URLs)")
+    parser.add_argument("--synthetic_entities", type=int, default=20000, help="without server URLs, benchmark local servers over a random index of this many entities")
+    parser.add_argument("--edges_per_entity", type=int, default=20, help="average out-degree of the random index")
+    parser.add_argument("--num_requests", type=int, default=1000)
+    parser.add_argument("--batch_size", type=int, default=32, help="QIDs per get_all_relations_batch call")
+    args = parser.parse_args()
+
+    if args.xmlrpc_url and args.msgpack_url:
+        urls = {"xmlrpc": args.xmlrpc_url, "msgpack": args.msgpack_url}
+        with open(args.qids, "r") as f:
+            qids = [line.strip() for line in f if line.strip()]
+    else:
+        print(f"Building a random index of {args.synthetic_entities} entities ...")
+        index = SyntheticIndex(args.synthetic_entities, args.edges_per_entity)
+        urls = start_synthetic_servers(index)
+        qids = index.qids
+
+    rng = random.Random(1)
+    single_calls = [[rng.choice(qids)] for _ in range(args.num_requests)]
+    batch_calls = [[rng.sample(qids, args.batch_size)] for _ in range(max(1, args.num_requests // args.batch_size))]
+    print(f"{'method':<32}{'transport':<10}{'p50 ms':>10}{'p99 ms':>10}{'req bytes':>12}{'resp bytes':>12}")
+    for method, calls in (
+        ("get_all_relations_of_an_entity", single_calls),
+        ("get_all_relations_batch", batch_calls),
+    ):
+        for protocol, url in urls.items():
+            stats = run(url, method, calls)
+            print(
+                f"{method:<32}{protocol:<10}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+                f"{stats['request_bytes']:>12.0f}{stats['response_bytes']:>12.0f}"
+            )
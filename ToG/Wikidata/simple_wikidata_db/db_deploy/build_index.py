@@ -16,13 +16,23 @@ from simple_wikidata_db.db_deploy.utils import (
     jsonl_generator,
     read_relation_label,
     read_entity_label,
+    shard_of,
 )
 import typing as tp
 
+SHARD_MAP_FILE = "shard_map.json"
 
-def read_relation_entities(filename):
+
+def owned_by(key, shard):
+    # shard is (chunk_idx, num_chunks) under the hash partition; None keeps everything.
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+
+def read_relation_entities(filename, shard=None):
     relation_entities = []
     for item in jsonl_generator(filename):
+        if not (owned_by(item["qid"], shard) or owned_by(item["value"], shard)):
+            continue
         relation_entities.append(
             {
                 "head_qid": item["qid"],
@@ -33,9 +43,11 @@ def read_relation_entities(filename):
     return relation_entities
 
 
-def read_tail_values(filename):
+def read_tail_values(filename, shard=None):
     relation_entities = []
     for item in jsonl_generator(filename):
+        if not owned_by(item["qid"], shard):
+            continue
         relation_entities.append(
             {
                 "head_qid": item["qid"],
@@ -46,9 +58,11 @@ def read_tail_values(filename):
     return relation_entities
 
 
-def read_external_ids(filename):
+def read_external_ids(filename, shard=None):
     relation_entities = []
     for item in jsonl_generator(filename):
+        if not (owned_by(item["qid"], shard) or owned_by(item["value"], shard)):
+            continue
         relation_entities.append(
             {
                 "qid": item["qid"],
@@ -76,6 +90,18 @@ def merge_defaultdicts(
     return merged_dict
 
 
+def write_shard_map(output_dir, partition, num_chunks):
+    """
+    Publishes how entities are spread over the chunks. With the hash partition every record keyed by a
+    QID (or MID) is in chunk shard_of(key, num_chunks), so clients can query that single server.
+    """
+    path = os.path.join(output_dir, SHARD_MAP_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"partition": partition, "num_chunks": num_chunks, "hash": "crc32"}, f)
+    os.replace(tmp_path, path)
+
+
 def filter_value(
     dict_list: tp.List[tp.Dict],
     key: str,
@@ -183,12 +209,18 @@ def main(args):
     # missing_pids = []
 
     # Step 3: Read entity_rels, entity_values, and external_ids
+    write_shard_map(args.output_dir, args.partition, num_chunks)
+    hash_partition = args.partition == "hash"
     for i in range(num_chunks):
         if args.chunk_idx != -1 and i != args.chunk_idx:
             continue
+        # range: chunk i is the i-th slice of the batch files.
+        # hash: chunk i scans every file and keeps the records whose key hashes to i.
+        shard = (i, num_chunks) if hash_partition else None
+        owned = partial(owned_by, shard=shard)
         start = i * chunk_size_entity_rels
         end = start + chunk_size_entity_rels
-        chunk_files = files_index["entity_rels"][start:end]
+        chunk_files = files_index["entity_rels"] if hash_partition else files_index["entity_rels"][start:end]
 
         relations_linked_to_entities = defaultdict(a_factory)
         entities_related_to_relent_pair = defaultdict(a_factory)
@@ -197,7 +229,7 @@ def main(args):
         print(f"Processing `entity_rels` of chunk {i+1} ...")
         for output in tqdm(
             pool.imap_unordered(
-                read_relation_entities,
+                partial(read_relation_entities, shard=shard),
                 chunk_files,
                 chunksize=1,
             )
@@ -211,37 +243,38 @@ def main(args):
                     pid=item["pid"],
                     label=pid_to_name.get(item["pid"], "N/A"),
                 )
-                relations_linked_to_entities[item["head_qid"]]["head"].append(
-                    rel
-                )
-                relations_linked_to_entities[item["tail_qid"]]["tail"].append(
-                    rel
-                )
-
-                entities_related_to_relent_pair[
-                    f'{item["head_qid"]}@{item["pid"]}'
-                ]["tail"].append(
-                    Entity(
-                        qid=item["tail_qid"],
-                        label=qid_to_name.get(item["tail_qid"], "N/A"),
+                if owned(item["head_qid"]):
+                    relations_linked_to_entities[item["head_qid"]]["head"].append(
+                        rel
                     )
-                )
-                entities_related_to_relent_pair[
-                    f'{item["tail_qid"]}@{item["pid"]}'
-                ]["head"].append(
-                    Entity(
-                        qid=item["head_qid"],
-                        label=qid_to_name.get(item["head_qid"], "N/A"),
+                    entities_related_to_relent_pair[
+                        f'{item["head_qid"]}@{item["pid"]}'
+                    ]["tail"].append(
+                        Entity(
+                            qid=item["tail_qid"],
+                            label=qid_to_name.get(item["tail_qid"], "N/A"),
+                        )
+                    )
+                if owned(item["tail_qid"]):
+                    relations_linked_to_entities[item["tail_qid"]]["tail"].append(
+                        rel
+                    )
+                    entities_related_to_relent_pair[
+                        f'{item["tail_qid"]}@{item["pid"]}'
+                    ]["head"].append(
+                        Entity(
+                            qid=item["head_qid"],
+                            label=qid_to_name.get(item["head_qid"], "N/A"),
+                        )
                     )
-                )
 
         print(f"Processing `entity_values` of chunk {i+1} ...")
         start = i * chunk_size_entity_values
         end = start + chunk_size_entity_values
-        chunk_files = files_index["entity_values"][start:end]
+        chunk_files = files_index["entity_values"] if hash_partition else files_index["entity_values"][start:end]
         for output in tqdm(
             pool.imap_unordered(
-                read_tail_values,
+                partial(read_tail_values, shard=shard),
                 chunk_files,
                 chunksize=1,
             )
@@ -264,15 +297,17 @@ def main(args):
         print(f"Processing `external_ids` of chunk {i+1} ...")
         start = i * chunk_size_external_ids
         end = start + chunk_size_external_ids
-        chunk_files = files_index["external_ids"][start:end]
+        chunk_files = files_index["external_ids"] if hash_partition else files_index["external_ids"][start:end]
         for output in tqdm(
-            pool.imap_unordered(read_external_ids, chunk_files, chunksize=1)
+            pool.imap_unordered(partial(read_external_ids, shard=shard), chunk_files, chunksize=1)
         ):
             for item in output:
-                external_ids[f'{item["qid"]}@{item["pid"]}'].append(
-                    item["value"]
-                )
-                mid_to_qid[f'{item["value"]}'].append(item["qid"])
+                if owned(item["qid"]):
+                    external_ids[f'{item["qid"]}@{item["pid"]}'].append(
+                        item["value"]
+                    )
+                if owned(item["value"]):
+                    mid_to_qid[f'{item["value"]}'].append(item["qid"])
 
         # Dump 3 index files
         with open(
@@ -334,6 +369,13 @@ if __name__ == "__main__":
     parser.add_argument("--num_chunks", type=int, default=5)
     parser.add_argument("--num_workers", type=int, default=400)
     parser.add_argument("--chunk_idx", type=int, default=-1)
+    parser.add_argument(
+        "--partition",
+        type=str,
+        default="range",
+        choices=["range", "hash"],
+        help="range: chunk i holds the i-th slice of the dump files. hash: chunk i holds every entity with shard_of(qid) == i, which lets the client query only the owning server",
+    )
 
     args = parser.parse_args()
     main(args)
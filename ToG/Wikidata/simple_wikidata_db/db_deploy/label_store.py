@@ -0,0 +1,182 @@
+import os
+import typing as tp
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+from simple_wikidata_db.db_deploy.utils import (
+    get_batch_files,
+    read_entity_label,
+    read_relation_label,
+)
+
+LABEL_STORE_DIR_NAME = "label_store"
+
+
+class StringTable:
+    """
+    Read-only sequence of strings stored as one UTF-8 blob plus offsets. order is the permutation
+    that sorts the strings (None if they are stored sorted), so lookups binary search the
+    memory-mapped arrays without decoding the whole table.
+    """
+
+    def __init__(self, data, offsets, order=None):
+        # Indexing memoryviews of the mapped arrays is much cheaper than indexing the memmaps.
+        self.data = memoryview(data)
+        self.offsets = memoryview(offsets)
+        self.order = memoryview(order) if order is not None else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _bytes(self, index):
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]])
+
+    def __getitem__(self, index):
+        return self._bytes(index).decode("utf-8")
+
+    def _sorted(self, position):
+        # UTF-8 bytes compare in code point order, i.e. like the str values used to sort the table.
+        return self._bytes(self.order[position] if self.order is not None else position)
+
+    def _bound(self, key, upper):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._sorted(mid)
+            if value < key or (upper and value == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find_all(self, key) -> tp.List[int]:
+        """Indices of all strings equal to key, in storage order."""
+        key = key.encode("utf-8")
+        lo = self._bound(key, upper=False)
+        if lo == len(self) or self._sorted(lo) != key:
+            return []
+        hi = self._bound(key, upper=True)
+        if self.order is None:
+            return list(range(lo, hi))
+        return sorted(self.order[lo:hi])
+
+
+def save_string_table(strings, store_dir, name, sorted_index=True):
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(store_dir, f"{name}.data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(store_dir, f"{name}.offsets.npy"), offsets)
+    if sorted_index:
+        order = np.array(sorted(range(len(strings)), key=strings.__getitem__), dtype=np.int64)
+        np.save(os.path.join(store_dir, f"{name}.order.npy"), order)
+
+
+def load_string_table(store_dir, name, mmap_mode="r"):
+    data = np.load(os.path.join(store_dir, f"{name}.data.npy"), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(store_dir, f"{name}.offsets.npy"), mmap_mode=mmap_mode)
+    order_path = os.path.join(store_dir, f"{name}.order.npy")
+    order = np.load(order_path, mmap_mode=mmap_mode) if os.path.exists(order_path) else None
+    return StringTable(data, offsets, order)
+
+
+class LabelTable:
+    """
+    id <=> label mapping of entities (QIDs) or properties (PIDs). Ids are stored sorted, labels
+    aligned with them plus a sort permutation, so both directions are binary searches.
+    """
+
+    def __init__(self, ids: StringTable, labels: StringTable):
+        self.ids = ids
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id2label(self, item_id: str) -> tp.Optional[str]:
+        positions = self.ids.find_all(item_id)
+        return self.labels[positions[0]] if positions else None
+
+    def label2ids(self, label: str) -> tp.List[str]:
+        return [self.ids[position] for position in self.labels.find_all(label)]
+
+
+def save_label_table(id_to_label: tp.Dict[str, str], store_dir: str, name: str):
+    ids = sorted(id_to_label)
+    save_string_table(ids, store_dir, f"{name}_ids", sorted_index=False)
+    save_string_table([id_to_label[item_id] for item_id in ids], store_dir, f"{name}_labels")
+
+
+def load_label_table(store_dir: str, name: str, mmap_mode="r") -> LabelTable:
+    return LabelTable(
+        load_string_table(store_dir, f"{name}_ids", mmap_mode),
+        load_string_table(store_dir, f"{name}_labels", mmap_mode),
+    )
+
+
+class LabelStore:
+    """
+    Entity and property labels, memory-mapped from the files written by build_label_store.
+    Every server process on a machine shares the same page cache instead of holding its own dicts.
+    """
+
+    def __init__(self, store_dir: str, mmap_mode="r"):
+        self.entities = load_label_table(store_dir, "entity", mmap_mode)
+        self.relations = load_label_table(store_dir, "relation", mmap_mode)
+
+    def qid2label(self, qid: str) -> tp.Optional[str]:
+        return self.entities.id2label(qid)
+
+    def label2qid(self, label: str) -> tp.List[str]:
+        return self.entities.label2ids(label)
+
+    def pid2label(self, pid: str) -> tp.Optional[str]:
+        return self.relations.id2label(pid)
+
+    def label2pid(self, label: str) -> tp.List[str]:
+        return self.relations.label2ids(label)
+
+
+def build_label_store(data_dir: str, output_dir: str, num_workers: int = 400):
+    """Reads the `labels` and `plabels` tables of the preprocessed dump once and writes the store."""
+    os.makedirs(output_dir, exist_ok=True)
+    with Pool(processes=num_workers) as pool:
+        for table, reader, name in (
+            ("plabels", read_relation_label, "relation"),
+            ("labels", read_entity_label, "entity"),
+        ):
+            print(f"Reading {table} ...")
+            id_to_label = {}
+            for output in tqdm(
+                pool.imap_unordered(
+                    reader, get_batch_files(os.path.join(data_dir, table)), chunksize=1
+                )
+            ):
+                id_to_label.update(output[0])
+            print(f"Writing {len(id_to_label)} {name} labels ...")
+            save_label_table(id_to_label, output_dir, name)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        required=True,
+        help="Preprocessed Wikidata dumpfile directory",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="Output directory, defaults to input_dir/label_store",
+    )
+    parser.add_argument("--num_workers", type=int, default=400)
+    args = parser.parse_args()
+    build_label_store(
+        args.input_dir,
+        args.output_dir or os.path.join(args.input_dir, LABEL_STORE_DIR_NAME),
+        args.num_workers,
+    )
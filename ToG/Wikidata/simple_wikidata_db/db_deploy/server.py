@@ -1,7 +1,11 @@
+import gc
 import os
 import pickle
+import signal
+import sys
 import typing as tp
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import partial
 from multiprocessing import Pool
@@ -17,6 +21,7 @@ from simple_wikidata_db.db_deploy.utils import (
     read_entity_label,
     read_relation_label,
 )
+from simple_wikidata_db.db_deploy.label_store import LabelStore
 import ujson as json
 from tqdm import tqdm
 import itertools
@@ -42,41 +47,24 @@ class WikidataQueryServer:
         chunk_number: int,
         data_dir: str,
         num_workers: int = 400,
+        label_store_dir: tp.Optional[str] = None,
     ):
         self.num_workers = num_workers
-        self.pool = Pool(processes=self.num_workers)
-
-        self.files_index = {
-            "labels": get_batch_files(os.path.join(data_dir, "labels")),
-            "plabels": get_batch_files(os.path.join(data_dir, "plabels")),
-        }
+        self.chunk_number = chunk_number
+        self.shard_map = {"partition": "range", "num_chunks": 0}
+        shard_map_path = os.path.join(data_dir, "indices", "shard_map.json")
+        if os.path.exists(shard_map_path):
+            with open(shard_map_path, "r") as f:
+                self.shard_map = json.load(f)
+        print(f"Shard map: {self.shard_map}")
 
-        self.qid_to_name = {}
-        self.name_to_qid = defaultdict(list)
-        self.pid_to_name = {}
-        self.name_to_pid = defaultdict(list)
-        print("Reading relation labels ...")
-        for output in tqdm(
-            self.pool.imap_unordered(
-                read_relation_label, self.files_index["plabels"], chunksize=1
-            )
-        ):
-            self.pid_to_name.update(output[0])
-            self.name_to_pid = merge_list_of_list(self.name_to_pid, output[1])
-        for k, v in self.name_to_pid.items():
-            self.name_to_pid[k] = list(itertools.chain(*v))
-
-        print("Reading entity labels ...")
-        for output in tqdm(
-            self.pool.imap_unordered(
-                read_entity_label, self.files_index["labels"], chunksize=1
-            )
-        ):
-            self.qid_to_name.update(output[0])
-            self.name_to_qid = merge_list_of_list(self.name_to_qid, output[1])
-
-        for k, v in self.name_to_qid.items():
-            self.name_to_qid[k] = list(itertools.chain(*v))
+        self.label_store = None
+        if label_store_dir is not None:
+            # Memory-mapped labels written once by label_store.py, shared by all servers on the machine.
+            print(f"Opening label store {label_store_dir} ...")
+            self.label_store = LabelStore(label_store_dir)
+        else:
+            self.read_labels(data_dir)
 
         print("Reading links ...")
         chunk_number = chunk_number + 1
@@ -118,22 +106,76 @@ class WikidataQueryServer:
         ) as handle:
             self.mid_to_qid = pickle.load(handle)
 
+    def read_labels(self, data_dir: str):
+        self.pool = Pool(processes=self.num_workers)
+
+        self.files_index = {
+            "labels": get_batch_files(os.path.join(data_dir, "labels")),
+            "plabels": get_batch_files(os.path.join(data_dir, "plabels")),
+        }
+
+        self.qid_to_name = {}
+        self.name_to_qid = defaultdict(list)
+        self.pid_to_name = {}
+        self.name_to_pid = defaultdict(list)
+        print("Reading relation labels ...")
+        for output in tqdm(
+            self.pool.imap_unordered(
+                read_relation_label, self.files_index["plabels"], chunksize=1
+            )
+        ):
+            self.pid_to_name.update(output[0])
+            self.name_to_pid = merge_list_of_list(self.name_to_pid, output[1])
+        for k, v in self.name_to_pid.items():
+            self.name_to_pid[k] = list(itertools.chain(*v))
+
+        print("Reading entity labels ...")
+        for output in tqdm(
+            self.pool.imap_unordered(
+                read_entity_label, self.files_index["labels"], chunksize=1
+            )
+        ):
+            self.qid_to_name.update(output[0])
+            self.name_to_qid = merge_list_of_list(self.name_to_qid, output[1])
+
+        for k, v in self.name_to_qid.items():
+            self.name_to_qid[k] = list(itertools.chain(*v))
+
         # See the number of conflict names by making differences in length
         dup_entity_names = len(self.qid_to_name) - len(self.name_to_qid)
         print(
             f"Total entities = {len(self.qid_to_name)}, duplicate names = {dup_entity_names}"
         )
+        self.pool.close()
+
+    def shard_info(self) -> tp.Dict:
+        # Lets clients route QID-keyed queries to the owning chunk (hash partition only).
+        return {
+            "partition": self.shard_map["partition"],
+            "num_chunks": self.shard_map["num_chunks"],
+            "chunk": self.chunk_number,
+        }
 
     def label2qid(self, label: str) -> tp.List[Entity]:
+        if self.label_store is not None:
+            return self.label_store.label2qid(label) or "Not Found!"
         return self.name_to_qid.get(label, "Not Found!")
 
     def label2pid(self, label: str) -> tp.List[Relation]:
+        if self.label_store is not None:
+            return self.label_store.label2pid(label) or "Not Found!"
         return self.name_to_pid.get(label, "Not Found!")
 
     def qid2label(self, qid: str) -> tp.List[Entity]:
+        if self.label_store is not None:
+            label = self.label_store.qid2label(qid)
+            return label if label is not None else "Not Found!"
         return self.qid_to_name.get(qid, "Not Found!")
 
     def pid2label(self, pid: str) -> tp.List[Relation]:
+        if self.label_store is not None:
+            label = self.label_store.pid2label(pid)
+            return label if label is not None else "Not Found!"
         return self.pid_to_name.get(pid, "Not Found!")
 
     def mid2qid(self, mid: str) -> tp.List[str]:
@@ -171,17 +213,107 @@ class WikidataQueryServer:
         except KeyError:
             return "Not Found!"
 
+    # Batched lookups: one call resolves a whole search frontier, results are aligned with the inputs.
+    def qid2label_batch(self, qids: tp.List[str]) -> tp.List[str]:
+        return [self.qid2label(qid) for qid in qids]
+
+    def get_all_relations_batch(
+        self, entity_qids: tp.List[str]
+    ) -> tp.List[tp.Dict[str, tp.List[Relation]]]:
+        return [self.get_all_relations_of_an_entity(qid) for qid in entity_qids]
+
+    def get_tail_entities_batch(
+        self, head_relation_pairs: tp.List[tp.List[str]]
+    ) -> tp.List[tp.Dict[str, tp.List[Entity]]]:
+        return [
+            self.get_tail_entities_given_head_and_relation(head_qid, relation_pid)
+            for head_qid, relation_pid in head_relation_pairs
+        ]
+
 
 class RequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ("/RPC2",)
 
 
+class PooledXMLRPCServer(SimpleXMLRPCServer):
+    """
+    SimpleXMLRPCServer handling requests on a fixed pool of num_threads threads, or inline
+    (one at a time) when num_threads is 0. Lookups only read the loaded index, so they need no locks.
+    """
+
+    # Many ToG workers connect at once; the default backlog of 5 makes their connections fail.
+    request_queue_size = 128
+
+    def __init__(self, addr, num_threads: int = 0, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=num_threads) if num_threads > 0 else None
+
+    def process_request(self, request, client_address):
+        if self.pool is None:
+            return super().process_request(request, client_address)
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve_prefork(server, num_workers: int):
+    """
+    Forks num_workers processes after the index is loaded. They accept connections on the shared
+    listening socket and share the index pages copy-on-write.
+    """
+    # A non-blocking listening socket lets the workers that lose the race for a connection go back to waiting.
+    server.socket.setblocking(False)
+    # Keep the cyclic GC from touching (and so copying) the pages of the loaded index in every worker.
+    gc.freeze()
+    children = []
+    for _ in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"Started {num_workers} worker processes: {children}")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
 class XMLRPCWikidataQueryServer(WikidataQueryServer):
     def __init__(self, addr, server_args, requestHandler=RequestHandler):
         super().__init__(
-            chunk_number=server_args.chunk_number, data_dir=server_args.data_dir
+            chunk_number=server_args.chunk_number,
+            data_dir=server_args.data_dir,
+            label_store_dir=server_args.label_store,
         )
-        self.server = SimpleXMLRPCServer(addr, requestHandler=requestHandler)
+        self.worker_mode = server_args.worker_mode
+        self.workers = server_args.workers
+        if server_args.protocol == "msgpack":
+            # Imported lazily, msgpack is only needed by the binary transport.
+            from simple_wikidata_db.db_deploy.msgpack_rpc import MsgpackRPCServer
+
+            # Connections are persistent, so each one has its own thread in every mode.
+            self.server = MsgpackRPCServer(addr)
+        else:
+            self.server = PooledXMLRPCServer(
+                addr,
+                num_threads=self.workers if self.worker_mode == "thread" else 0,
+                requestHandler=requestHandler,
+            )
         self.server.register_introspection_functions()
         self.server.register_function(self.get_all_relations_of_an_entity)
         self.server.register_function(
@@ -198,9 +330,16 @@ class XMLRPCWikidataQueryServer(WikidataQueryServer):
             self.get_external_id_given_head_and_relation
         )
         self.server.register_function(self.mid2qid)
+        self.server.register_function(self.shard_info)
+        self.server.register_function(self.qid2label_batch)
+        self.server.register_function(self.get_all_relations_batch)
+        self.server.register_function(self.get_tail_entities_batch)
 
     def serve_forever(self):
-        self.server.serve_forever()
+        if self.worker_mode == "prefork":
+            serve_prefork(self.server, self.workers)
+        else:
+            self.server.serve_forever()
 
 
 if __name__ == "__main__":
@@ -215,12 +354,39 @@ if __name__ == "__main__":
     )
     parser.add_argument("--port", type=int, default=23546, help="Port number")
     parser.add_argument("--host_ip", type=str, required=True, help="Host IP")
+    parser.add_argument(
+        "--label_store",
+        type=str,
+        default=None,
+        help="Label store built by label_store.py; without it every server reads all label files itself",
+    )
+    parser.add_argument(
+        "--protocol",
+        type=str,
+        default="xmlrpc",
+        choices=["xmlrpc", "msgpack"],
+        help="xmlrpc: XML-RPC over HTTP (http:// URLs). msgpack: length-prefixed msgpack over persistent TCP connections (msgpack:// URLs)",
+    )
+    parser.add_argument(
+        "--worker_mode",
+        type=str,
+        default="thread",
+        choices=["single", "thread", "prefork"],
+        help="single: one request at a time. thread: a pool of --workers threads. prefork: --workers processes forked after the index is loaded, sharing it copy-on-write",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of threads (thread) or processes (prefork) serving requests",
+    )
     args = parser.parse_args()
     print("Start with my program now!!!")
     server = XMLRPCWikidataQueryServer(
         addr=("0.0.0.0", args.port), server_args=args
     )
     with open("server_urls_new.txt", "a") as f:
-        f.write(f"http://{args.host_ip}:{args.port}\n")
-    print(f"XMLRPC WDQS server ready and listening on 0.0.0.0:{args.port}")
+        scheme = "msgpack" if args.protocol == "msgpack" else "http"
+        f.write(f"{scheme}://{args.host_ip}:{args.port}\n")
+    print(f"{args.protocol} WDQS server ready and listening on 0.0.0.0:{args.port}")
     server.serve_forever()
@@ -3,6 +3,7 @@ from dataclasses import dataclass
 from traitlets import default
 import ujson as json
 import os
+import zlib
 
 
 @dataclass
@@ -34,6 +35,11 @@ def jsonl_generator(fname):
         yield d
 
 
+def shard_of(key: str, num_shards: int) -> int:
+    """Chunk owning a QID/MID under the hash partition (build_index.py --partition hash)."""
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
 def get_batch_files(fdir):
     """Returns paths to files in fdir."""
     filenames = os.listdir(fdir)
@@ -1,5 +1,5 @@
 import argparse
-from utils import *
+from eval_utils import *
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -11,13 +11,21 @@ if __name__ == '__main__':
                         default="ToG", help="The name of the method being evaluated.")
     args = parser.parse_args()
 
-    # prepare_dataset_for_eval is now corrected to load JSONL files
+    # prepare_dataset_for_eval is now corrected to load JSONL files; the output rows are streamed
     ground_truth_datas, question_string, output_datas = prepare_dataset_for_eval(args.dataset, args.output_file)
+    ground_truth_index = GroundTruthIndex(ground_truth_datas, question_string)
 
     num_right = 0
     num_error = 0
+    num_unmatched = 0
+    total = 0
     for data in output_datas:
-        answers = align(args.dataset, question_string, data, ground_truth_datas)
+        total += 1
+        answers = align(args.dataset, question_string, data, ground_truth_index)
+        if answers is None:
+            num_unmatched += 1
+            num_error += 1
+            continue
         results = data['results']
         
         # 1. 首先，尝试用智能的方式提取大括号里的内容
@@ -35,12 +43,16 @@ if __name__ == '__main__':
             num_error += 1
     
     # This part prints to the console
-    print(f"Total Processed: {len(output_datas)}")
+    print(f"Total Processed: {total}")
     print(f"Right: {num_right}, Error: {num_error}")
-    if len(output_datas) > 0:
-        print(f"Exact Match: {float(num_right / len(output_datas))}")
+    if num_unmatched:
+        print(f"Warning: {num_unmatched} output rows had no ground truth and were counted as errors.")
+    if ground_truth_index.conflicts:
+        print(f"Warning: {ground_truth_index.conflicts} output rows had an id and a question matching different ground-truth items; the question match was used.")
+    if total > 0:
+        print(f"Exact Match: {float(num_right / total)}")
 
     # Save the final results to a JSON file
-    save_result2json(args.dataset, num_right, num_error, len(output_datas), args.method)
+    save_result2json(args.dataset, num_right, num_error, total, args.method)
     
     print(f"\nEvaluation results saved to ToG_{args.dataset}_results.json")
\ No newline at end of file
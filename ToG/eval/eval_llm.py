@@ -1,10 +1,14 @@
 import argparse
+import hashlib
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import openai # LEGACY: Import the module directly
 from tqdm import tqdm
 import jsonlines
+from eval_utils import GroundTruthIndex, iter_output_datas
 
 # --- CORRECTED PROMPT TEMPLATE ---
 # All literal curly braces {{}} are now correctly escaped.
@@ -62,7 +66,24 @@ Model's Answer: "{model_answer}"
 Your Judgment:
 """
 
-def get_llm_judgment(question: str, ground_truth: str, model_answer: str, model: str):
+class RateLimiter:
+    """Spaces request starts at least 60 / requests_per_minute seconds apart, across all threads."""
+    def __init__(self, requests_per_minute=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def get_llm_judgment(question: str, ground_truth: str, model_answer: str, model: str, rate_limiter=None):
     """Calls the judge LLM to get a decision using the legacy openai<1.0 syntax."""
     # This line will now work correctly
     prompt = JUDGE_PROMPT_TEMPLATE.format(
@@ -71,6 +92,8 @@ def get_llm_judgment(question: str, ground_truth: str, model_answer: str, model:
         model_answer=model_answer
     )
     for _ in range(3): # Retry up to 3 times
+        if rate_limiter:
+            rate_limiter.wait()
         try:
             response = openai.ChatCompletion.create(
                 model=model,
@@ -94,6 +117,76 @@ def get_llm_judgment(question: str, ground_truth: str, model_answer: str, model:
             
     return {"decision": "Error", "reason": "Failed to get a valid response from the API after 3 attempts."}
 
+def judgment_key(question, ground_truth, model_answer, judge_model):
+    payload = json.dumps([question, ground_truth, model_answer, judge_model], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def load_judgments(judgments_file):
+    """Reads the judgments file into a key -> judgment dict. Failed (Error) judgments are not reused."""
+    judgments = {}
+    if not os.path.exists(judgments_file):
+        return judgments
+    valid_bytes = 0
+    with open(judgments_file, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partial last line of an interrupted run
+            valid_bytes += len(line)
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if row.get('decision') in ("Correct", "Incorrect"):
+                judgments[row['key']] = row
+    if valid_bytes < os.path.getsize(judgments_file):
+        with open(judgments_file, 'r+b') as f:
+            f.truncate(valid_bytes)
+    return judgments
+
+def judge_concurrently(jobs, judge, num_workers, key=lambda job: job[0]):
+    """
+    Runs judge(job) on a bounded pool, keeping at most 2 * num_workers jobs in flight, and yields (result, duplicate)
+    for every job as results arrive. A job whose key was already submitted in this run is not judged again: it gets
+    the pending (or finished) result of the first job with that key, with duplicate=True.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = {}  # future -> number of duplicate jobs waiting for it
+        future_keys = {}
+        in_flight = {}  # key -> future
+        finished = {}  # key -> result
+
+        def collect(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                duplicates = pending.pop(future)
+                result = future.result()
+                job_key = future_keys.pop(future)
+                del in_flight[job_key]
+                finished[job_key] = result
+                yield result, False
+                for _ in range(duplicates):
+                    yield result, True
+
+        for job in jobs:
+            job_key = key(job)
+            if job_key in finished:
+                yield finished[job_key], True
+                continue
+            if job_key in in_flight:
+                pending[in_flight[job_key]] += 1
+                continue
+            if len(pending) >= 2 * num_workers:
+                yield from collect(FIRST_COMPLETED)
+                if job_key in finished:
+                    yield finished[job_key], True
+                    continue
+            future = executor.submit(judge, job)
+            pending[future] = 0
+            future_keys[future] = job_key
+            in_flight[job_key] = future
+        while pending:
+            yield from collect(FIRST_COMPLETED)
+
 def main():
     parser = argparse.ArgumentParser(description="Evaluate ToG results using a legacy LLM-as-judge script.")
     parser.add_argument("--dataset", type=str, default="grbench", help="Choose the dataset.")
@@ -101,16 +194,19 @@ def main():
     parser.add_argument("--ground_truth_file", type=str, default="/shared/data3/hansont2/GRbench/QA/amazon/data.json", help="The ground truth QA file.")
     parser.add_argument("--api_key", type=str, default="", help="Your OpenAI API key.")
     parser.add_argument("--judge_model", type=str, default="gpt-4o-mini", help="The OpenAI model to use as the judge.")
+    parser.add_argument("--num_workers", type=int, default=8, help="Number of judge requests in flight.")
+    parser.add_argument("--requests_per_minute", type=int, default=None, help="Judge request rate limit (unlimited by default).")
+    parser.add_argument("--judgments_file", type=str, default=None, help="JSONL file of per-row judgments, reused as a cache on later runs (default: <output_file>.judgments.jsonl).")
     args = parser.parse_args()
 
     # --- Load Data ---
-    with open(args.output_file, 'r', encoding='utf-8') as f:
-        output_datas = [json.loads(line) for line in f]
-    
     with open(args.ground_truth_file, 'r', encoding='utf-8') as f:
         ground_truth_list = [json.loads(line) for line in f]
     
-    gt_lookup = {item['question']: item['answer'] for item in ground_truth_list}
+    gt_index = GroundTruthIndex(ground_truth_list, 'question')
+    judgments_file = args.judgments_file or args.output_file + ".judgments.jsonl"
+    cached_judgments = load_judgments(judgments_file)
+    print(f"Loaded {len(cached_judgments)} cached judgments from {judgments_file}.")
 
     # --- LEGACY: Set API Key on the module ---
     openai.api_key = args.api_key or os.getenv("OPENAI_API_KEY")
@@ -121,36 +217,71 @@ def main():
     num_right = 0
     num_error = 0
     num_api_errors = 0
+    num_cached = 0
+    total = 0
 
-    for data in tqdm(output_datas, desc="Evaluating with LLM Judge (Legacy)"):
-        question = data['question']
-        model_answer = data['results']
-        
-        ground_truth_answer = gt_lookup.get(question)
-        if not ground_truth_answer:
-            print(f"\nWarning: Could not find ground truth for question: {question}")
-            continue
-
-        judgment = get_llm_judgment(question, ground_truth_answer, model_answer, args.judge_model)
-        
-        if judgment['decision'] == "Correct":
+    def count(decision):
+        nonlocal num_right, num_error, num_api_errors
+        if decision == "Correct":
             num_right += 1
-        elif judgment['decision'] == "Incorrect":
+        elif decision == "Incorrect":
             num_error += 1
         else:
             num_api_errors += 1
 
+    def jobs():
+        # Yields the rows that still need a judge call; cached rows are counted here.
+        nonlocal total, num_cached
+        for data in iter_output_datas(args.output_file):
+            total += 1
+            question = data['question']
+            model_answer = data['results']
+
+            ground_truth_item = gt_index.lookup(data)
+            ground_truth_answer = ground_truth_item.get('answer') if ground_truth_item else None
+            if not ground_truth_answer:
+                print(f"\nWarning: Could not find ground truth for question: {question}")
+                continue
+
+            key = judgment_key(question, ground_truth_answer, model_answer, args.judge_model)
+            if key in cached_judgments:
+                num_cached += 1
+                count(cached_judgments[key]['decision'])
+                continue
+            yield key, question, ground_truth_answer, model_answer
+
+    rate_limiter = RateLimiter(args.requests_per_minute)
+
+    def judge(job):
+        key, question, ground_truth_answer, model_answer = job
+        judgment = get_llm_judgment(question, ground_truth_answer, model_answer, args.judge_model, rate_limiter)
+        return {"key": key, "question": question, "ground_truth": ground_truth_answer, "model_answer": model_answer,
+                "judge_model": args.judge_model, "decision": judgment.get('decision'), "reason": judgment.get('reason')}
+
+    # Each judgment is appended and flushed as soon as it arrives, so an interrupted run keeps its progress.
+    with open(judgments_file, 'a', encoding='utf-8') as judgments_out:
+        for row, duplicate in tqdm(judge_concurrently(jobs(), judge, args.num_workers), desc="Evaluating with LLM Judge (Legacy)"):
+            # Rows repeated within this run reuse the judgment of their first occurrence.
+            if duplicate:
+                num_cached += 1
+            else:
+                judgments_out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                judgments_out.flush()
+            count(row['decision'])
+
     # --- Print Results ---
     total_judged = num_right + num_error
     print("\n--- LLM-as-Judge Evaluation Complete ---")
-    print(f"Total Judged: {total_judged} / {len(output_datas)}")
+    print(f"Total Judged: {total_judged} / {total} ({num_cached} from the judgment cache)")
     print(f"Correct: {num_right}")
     print(f"Incorrect: {num_error}")
     print(f"API Errors: {num_api_errors}")
+    if gt_index.conflicts:
+        print(f"Warning: {gt_index.conflicts} output rows had an id and a question matching different ground-truth items; the question match was used.")
     
     if total_judged > 0:
         accuracy = float(num_right / total_judged)
         print(f"Semantic Accuracy: {accuracy:.4f}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,10 @@
+import gzip
 import json
 import re
 
+# Keys holding a question id in the ground-truth files; output rows carrying one are joined on it.
+ID_KEYS = ['id', 'qid', 'ID', 'QuestionId']
+
 
 def prepare_dataset_for_eval(dataset_name, output_file):
     if dataset_name == 'cwq':
@@ -48,15 +52,62 @@ def prepare_dataset_for_eval(dataset_name, output_file):
     else:
         print("dataset not found, you should pick from {cwq, webqsp, grailqa, simpleqa, qald, webquestions, trex, zeroshotre, creak}.")
         exit(-1)
-    with open(output_file, 'r', encoding='utf-8') as f:
-        # Read each line as a separate JSON object
-        output_datas = [json.loads(line) for line in f]
-    return datas, question_string, output_datas
-
-
-def align(dataset_name, question_string, data, ground_truth_datas):
+    return datas, question_string, iter_output_datas(output_file)
+
+
+def iter_output_datas(output_file):
+    """Streams the rows of a ToG output file (.jsonl or .jsonl.gz) one at a time."""
+    opener = gzip.open if output_file.endswith('.gz') else open
+    with opener(output_file, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def normalize_question(question):
+    return ' '.join(question.lower().split())
+
+
+class GroundTruthIndex:
+    """
+    Hash index over the ground-truth items by normalized question and, where present, by question id.
+    Ids are keyed by (field, value), so ids from different schemes (e.g. `id` vs `QuestionId`) never join.
+    """
+    def __init__(self, ground_truth_datas, question_string):
+        self.question_string = question_string
+        self.by_question = {}
+        self.by_id = {}
+        self.conflicts = 0
+        for item in ground_truth_datas:
+            # setdefault keeps the first item of duplicated questions, like the former linear scan.
+            self.by_question.setdefault(normalize_question(item[question_string]), item)
+            for key in ID_KEYS:
+                if key in item:
+                    self.by_id.setdefault((key, str(item[key])), item)
+
+    def lookup(self, data):
+        by_question = None
+        if self.question_string in data:
+            by_question = self.by_question.get(normalize_question(data[self.question_string]))
+        by_id = None
+        for key in ID_KEYS:
+            if key in data and (key, str(data[key])) in self.by_id:
+                by_id = self.by_id[(key, str(data[key]))]
+                break
+        if by_id is not None and by_question is not None and by_id is not by_question:
+            # The id most likely comes from another numbering; trust the question text.
+            # Conflicts are only counted here, callers report the total after their pass.
+            self.conflicts += 1
+            return by_question
+        return by_id if by_id is not None else by_question
+
+
+def align(dataset_name, question_string, data, ground_truth_index):
+    """Returns the answer list of the ground-truth item of data, or None if it is not in the index."""
     answer_list= []
-    origin_data = [j for j in ground_truth_datas if j[question_string] == data[question_string]][0]
+    origin_data = ground_truth_index.lookup(data)
+    if origin_data is None:
+        return None
     if dataset_name == 'cwq':
         if 'answers' in origin_data:
             answers = origin_data["answers"]
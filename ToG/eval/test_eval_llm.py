@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+import pytest
+
+for module in ("openai", "tqdm", "jsonlines"):
+    pytest.importorskip(module)
+
+from eval_llm import RateLimiter, get_llm_judgment, judge_concurrently, load_judgments
+
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("".join(lines))
+
+
+def test_load_judgments_truncates_partial_line(tmp_path):
+    path = tmp_path / "judgments.jsonl"
+    complete = [
+        json.dumps({"key": "a", "decision": "Correct"}) + "\n",
+        json.dumps({"key": "b", "decision": "Error"}) + "\n",
+        json.dumps({"key": "c", "decision": "Incorrect"}) + "\n",
+    ]
+    write_lines(path, complete + ['{"key": "d", "decis'])
+
+    judgments = load_judgments(str(path))
+
+    assert sorted(judgments) == ["a", "c"]  # Error rows are judged again
+    assert path.read_text(encoding='utf-8') == "".join(complete)
+    # Rows appended after the truncation start on a fresh line.
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"key": "d", "decision": "Correct"}) + "\n")
+    assert sorted(load_judgments(str(path))) == ["a", "c", "d"]
+
+
+def test_load_judgments_missing_file(tmp_path):
+    assert load_judgments(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_rate_limiter_spaces_requests_across_threads():
+    limiter = RateLimiter(requests_per_minute=1200)  # one request every 50 ms
+    starts = []
+    lock = threading.Lock()
+
+    def request():
+        limiter.wait()
+        with lock:
+            starts.append(time.monotonic())
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    starts.sort()
+    gaps = [b - a for a, b in zip(starts, starts[1:])]
+    assert min(gaps) >= 0.045
+    assert starts[-1] - starts[0] >= 4 * 0.045
+
+
+def test_rate_limiter_unlimited_does_not_wait():
+    limiter = RateLimiter(None)
+    start = time.monotonic()
+    for _ in range(100):
+        limiter.wait()
+    assert time.monotonic() - start < 0.05
+
+
+def test_get_llm_judgment_waits_on_rate_limiter(monkeypatch):
+    class Limiter:
+        calls = 0
+
+        def wait(self):
+            self.calls += 1
+
+    class ChatCompletion:
+        @staticmethod
+        def create(**kwargs):
+            content = 'Judgment: {"decision": "Correct", "reason": "matches"}'
+            return {"choices": [{"message": {"content": content}}]}
+
+    monkeypatch.setattr("eval_llm.openai.ChatCompletion", ChatCompletion, raising=False)
+    limiter = Limiter()
+    judgment = get_llm_judgment("q", "a", "a", "judge", limiter)
+    assert judgment == {"decision": "Correct", "reason": "matches"}
+    assert limiter.calls == 1
+
+
+def test_judge_concurrently_reuses_results_of_duplicate_rows():
+    calls = []
+    lock = threading.Lock()
+
+    def judge(job):
+        with lock:
+            calls.append(job[0])
+        time.sleep(0.01)
+        return {"key": job[0], "decision": "Correct"}
+
+    # Duplicates both while the first job is in flight and after it finished.
+    keys = ["a", "b", "a", "c", "a", "b"] + [f"x{i}" for i in range(10)] + ["a", "c"]
+    results = list(judge_concurrently(((k, "question") for k in keys), judge, num_workers=2))
+
+    assert sorted(calls) == sorted(set(keys))
+    assert sorted(row["key"] for row, _ in results) == sorted(keys)
+    judged = [row["key"] for row, duplicate in results if not duplicate]
+    assert sorted(judged) == sorted(set(keys))